@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from catalog import write_catalog
+from metrics import RATE_STAGES, LatencyMetrics
+from pinecone_flow import build_bm25_index, convert_catalog_to_docs, export_local_vector_store
+from rosebud_chat_model import rosebud_chat_model
+
+BASELINE_PATH = './benchmark_baseline.json'
+
+BENCHMARK_QUERIES = [
+    "Recommend some films similar to star wars movies but not part of the star wars universe",
+    "Find me drama movies in English that are less than 2 hours long and feature dogs",
+    "What are some good comedies from the 90s?",
+    "Show me critically acclaimed thrillers I can stream on Netflix",
+    "I want a short animated film for a family night",
+    "Any horror films about haunted houses?",
+    "Romantic films set in Paris",
+    "Epic science fiction with space battles",
+]
+
+# Filters the fake query constructor picks from, covering no filter, a
+# list field, a numeric range and a compound filter
+FILTERS = [
+    'NO_FILTER',
+    'eq("Genre", "Drama")',
+    'and(gte("Release Year", 1990), lt("Runtime (minutes)", 120))',
+    'in("Stream", ["Netflix", "Max"])',
+    'and(eq("Language", "English"), gt("Rating", 7))',
+]
+
+GENRES = ['Drama', 'Comedy', 'Action', 'Horror', 'Science Fiction', 'Romance',
+          'Thriller', 'Animation', 'Adventure', 'Family']
+LANGUAGES = ['English', 'French', 'Japanese', 'Spanish', 'Korean']
+SERVICES = ['Netflix', 'Max', 'Hulu', 'Disney Plus', 'Amazon Prime Video', 'Apple TV']
+WORDS = ['space', 'dog', 'heist', 'family', 'war', 'love', 'paris', 'ghost',
+         'house', 'robot', 'detective', 'island', 'school', 'revenge', 'music',
+         'dragon', 'city', 'road', 'trip', 'friendship', 'murder', 'secret',
+         'future', 'king', 'ocean', 'monster', 'small town', 'courtroom']
+
+
+def fixture_catalog(n_films, seed=0):
+    """
+    A made-up film catalog with the same columns and value shapes as the
+    real one. The same {seed} always gives the same films.
+    """
+    rng = random.Random(seed)
+    for i in range(n_films):
+        words = rng.sample(WORDS, 6)
+        yield {
+            'TMDB ID': str(i),
+            'Title': f'{words[0].title()} {words[1].title()} {i}',
+            'Runtime (minutes)': rng.randint(75, 180),
+            'Language': rng.choice(LANGUAGES),
+            'Overview': f'A film about {words[0]}, {words[1]} and {words[2]}. '
+                        f'Set around a {words[3]}, it follows a {words[4]}.',
+            'Release Year': rng.randint(1950, 2023),
+            'Genre': rng.sample(GENRES, rng.randint(1, 3)),
+            'Keywords': words[2:],
+            'Actors': [f'Actor {rng.randint(0, 200)}' for _ in range(4)],
+            'Directors': [f'Director {rng.randint(0, 80)}'],
+            'Stream': rng.sample(SERVICES, rng.randint(0, 2)),
+            'Buy': rng.sample(SERVICES, 2),
+            'Rent': rng.sample(SERVICES, 2),
+            'Production Companies': [f'Studio {rng.randint(0, 40)}'],
+            'Rating': round(rng.uniform(4, 9), 1),
+        }
+
+
+def structured_query_response(prompt):
+    """
+    What the query constructor LLM would answer: the user's query with one
+    of FILTERS, picked by a stable hash of the query.
+    """
+    query = prompt.rsplit('User Query:', 1)[-1].split('Structured Request:')[0].strip()
+    filter = FILTERS[int(hashlib.sha1(query.encode('utf-8')).hexdigest(), 16) % len(FILTERS)]
+    return '```json\n' + json.dumps({'query': query, 'filter': filter}) + '\n```'
+
+
+def summary_response(prompt):
+    """
+    What the summary model would answer: a short recommendation for each
+    film in the context.
+    """
+    titles = re.findall(r'^\s*Title: (.+)$', prompt, flags=re.MULTILINE)[:5]
+    return ''.join(f'- **{title}**: Worth a watch, since its story lines up with '
+                   f'what you asked for and it is well reviewed.\n' for title in titles)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model stand-in that answers with {respond}(prompt), waiting
+    {latency} seconds before the first token and then streaming
+    {tokens_per_second} tokens a second. A token is a word here.
+    """
+    respond: Callable[[str], str]
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return 'benchmark-fake'
+
+    def _tokens(self, messages):
+        return re.findall(r'\S+\s*', self.respond('\n'.join(m.content for m in messages)))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = ''.join(chunk.message.content for chunk in self._stream(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = ''.join([chunk.message.content async for chunk in self._astream(messages)])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def benchmark_config(directory):
+    """
+    config.json with every file the pipeline writes moved into {directory}
+    and the local vector store and BM25 index switched on. The semantic
+    query cache is off, so every query runs the whole pipeline.
+    """
+    with open('./config.json') as f:
+        config = json.load(f)
+    config.update({
+        'vector_store': 'local',
+        'local_store_dir': os.path.join(directory, 'local_store'),
+        'hybrid_search': True,
+        'bm25_index_path': os.path.join(directory, 'bm25_index.json'),
+        'embedding_cache_dir': os.path.join(directory, 'embedding_cache'),
+        'query_constructor_cache_path': os.path.join(directory, 'query_constructor_cache.json'),
+        'query_cache_enabled': False,
+    })
+    return config
+
+
+def build_pipeline(directory, metrics, n_films, query_latency, first_token_latency,
+                   tokens_per_second):
+    """
+    Runs the flow's doc, local store and BM25 tasks over a fixture catalog,
+    then loads the chat model on top of them with fake chat models and
+    embeddings.
+    """
+    config = benchmark_config(directory)
+    embeddings = DeterministicFakeEmbedding(size=256)
+    catalog_path = os.path.join(directory, 'catalog.parquet')
+    write_catalog(fixture_catalog(n_films), catalog_path)
+
+    with metrics.span('convert_catalog_to_docs'):
+        docs = convert_catalog_to_docs.fn(catalog_path)
+    # Exported as the flow does alongside Pinecone, so the catalog version
+    # file the query cache reads is left alone
+    with metrics.span('export_local_vector_store'):
+        export_local_vector_store.fn(docs, {**config, 'vector_store': 'pinecone'},
+                                     embeddings=embeddings, count_tokens=count_words)
+    with metrics.span('build_bm25_index'):
+        build_bm25_index.fn(docs, config)
+
+    with metrics.span('load_model'):
+        return rosebud_chat_model(
+            config,
+            retriever_llm=FakeChatModel(respond=structured_query_response,
+                                        latency=query_latency),
+            summary_llm=FakeChatModel(respond=summary_response, latency=first_token_latency,
+                                      tokens_per_second=tokens_per_second),
+            embeddings=embeddings,
+            count_tokens=count_words,
+            latency_metrics=metrics,
+        )
+
+
+def run_sequential(model):
+    """
+    Answers each benchmark query one at a time with predict_stream.
+    """
+    for query in BENCHMARK_QUERIES:
+        for _ in model.predict_stream(query, {}):
+            pass
+
+
+def run_concurrent(model, concurrency):
+    """
+    Answers the benchmark queries {concurrency} at a time with
+    apredict_stream, reworded so structured queries cached by an earlier
+    run are not reused.
+
+    returns:
+    float: Queries answered per second
+    """
+    async def answer(query):
+        async for _ in model.apredict_stream(query, {}):
+            pass
+
+    async def answer_all(queries):
+        start = time.perf_counter()
+        for i in range(0, len(queries), concurrency):
+            await asyncio.gather(*(answer(query) for query in queries[i:i + concurrency]))
+        return len(queries) / (time.perf_counter() - start)
+
+    return asyncio.run(answer_all([f'{query}, please' for query in BENCHMARK_QUERIES]))
+
+
+def run_benchmark(n_films=300, concurrency=4, query_latency=0.02,
+                  first_token_latency=0.05, tokens_per_second=1000.0):
+    """
+    Benchmarks the pipeline offline against local stand-ins. The timed run
+    uses the given fake latencies. Peak memory comes from a separate run
+    with instant fakes, building the pipeline and answering queries
+    concurrently under tracemalloc, since tracing slows Python down too
+    much to time the same run.
+
+    parameters:
+    n_films (int): Films in the fixture catalog
+    concurrency (int): Queries in flight at once for the throughput run
+    query_latency (float): Seconds the fake query constructor takes
+    first_token_latency (float): Seconds before the fake summary model's first token
+    tokens_per_second (float): Rate the fake summary model streams at
+
+    returns:
+    dict: Settings, per-stage latency percentiles, throughput and peak memory
+    """
+    settings = {'n_films': n_films, 'concurrency': concurrency,
+                'query_latency': query_latency, 'first_token_latency': first_token_latency,
+                'tokens_per_second': tokens_per_second}
+
+    # Runs first, so imports and first-call setup are paid before timing
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        try:
+            model = build_pipeline(directory, LatencyMetrics(), n_films, 0, 0, 0)
+            run_concurrent(model, concurrency)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    metrics = LatencyMetrics()
+    with tempfile.TemporaryDirectory() as directory:
+        model = build_pipeline(directory, metrics, n_films, query_latency,
+                               first_token_latency, tokens_per_second)
+        run_sequential(model)
+        queries_per_second = run_concurrent(model, concurrency)
+
+    return {
+        'settings': settings,
+        'stages': metrics.snapshot(),
+        'throughput': {'concurrency': concurrency, 'queries_per_second': queries_per_second},
+        'peak_memory_mb': peak_memory / 2 ** 20,
+    }
+
+
+def compare(report, baseline, tolerance=0.5, slack_seconds=0.01):
+    """
+    Regressions of {report} against {baseline}: a stage whose p50 latency
+    is more than {tolerance} slower, plus {slack_seconds} so stages that
+    take microseconds do not trip on noise, a rate stage or throughput more
+    than {tolerance} lower, or peak memory more than {tolerance} higher.
+
+    returns:
+    list of str: One line per regression, empty if there are none
+    """
+    regressions = []
+    for stage, expected in baseline['stages'].items():
+        actual = report['stages'].get(stage)
+        if actual is None:
+            regressions.append(f'{stage}: not recorded')
+        elif stage in RATE_STAGES:
+            if actual['p50'] < expected['p50'] / (1 + tolerance):
+                regressions.append(f"{stage}: p50 {actual['p50']:.1f}/s, "
+                                   f"baseline {expected['p50']:.1f}/s")
+        elif actual['p50'] > expected['p50'] * (1 + tolerance) + slack_seconds:
+            regressions.append(f"{stage}: p50 {actual['p50'] * 1000:.1f}ms, "
+                               f"baseline {expected['p50'] * 1000:.1f}ms")
+
+    actual, expected = (report['throughput']['queries_per_second'],
+                        baseline['throughput']['queries_per_second'])
+    if actual < expected / (1 + tolerance):
+        regressions.append(f'throughput: {actual:.1f} queries/s, baseline {expected:.1f}')
+
+    actual, expected = report['peak_memory_mb'], baseline['peak_memory_mb']
+    if actual > expected * (1 + tolerance):
+        regressions.append(f'peak memory: {actual:.1f}MB, baseline {expected:.1f}MB')
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(report, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline latency and throughput benchmark')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f'Store this run as the baseline in {BASELINE_PATH}')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Runs with the baseline's settings so the numbers are comparable
+    settings = load_baseline()['settings'] if os.path.exists(BASELINE_PATH) else {}
+    report = run_benchmark(**settings)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        save_baseline(report)
+        print(f"Saved baseline to {BASELINE_PATH}")
+    elif settings:
+        regressions = compare(report, load_baseline(), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
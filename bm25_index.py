@@ -0,0 +1,128 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document
+
+from metadata_index import MetadataIndex
+from vector_sync import ID_FIELD
+
+BM25_INDEX_PATH = './data/bm25_index.json'
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+class BM25Index:
+    """
+    In-process BM25 keyword index over the page content of each document
+    (title, overview and keywords). It catches exact names and titles that
+    dense search ranks poorly. Filters are evaluated with a MetadataIndex,
+    so keyword hits obey the same structured query as vector hits.
+
+    parameters:
+    documents (list of Document): Documents to index
+    k1 (float): Term frequency saturation
+    b (float): Document length normalization
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        postings = {}
+        lengths = []
+        for row, doc in enumerate(documents):
+            terms = Counter(tokenize(doc.page_content))
+            lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(frequency)
+
+        # term -> (rows containing it, its frequency in each)
+        self.postings = {term: (np.array(rows, dtype=np.int64),
+                                np.array(frequencies, dtype=np.float32))
+                         for term, (rows, frequencies) in postings.items()}
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if len(documents) else 0.0
+        self.metadata_index = MetadataIndex([doc.metadata for doc in documents])
+
+    def idf(self, term):
+        frequency = len(self.postings[term][0])
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query, k=4, filter=None):
+        """
+        Top {k} documents for {query} by BM25 score, among the documents
+        passing {filter}. Documents sharing no term with the query are
+        never returned.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * self.lengths / (self.average_length or 1.0))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, frequencies = self.postings[term]
+            scores[rows] += self.idf(term) * frequencies * (self.k1 + 1) / (frequencies + norms[rows])
+
+        if filter:
+            scores[~self.metadata_index.evaluate(filter)] = 0
+        hits = np.flatnonzero(scores)
+        top = hits[np.argsort(-scores[hits], kind='stable')[:k]]
+        return [self.documents[row] for row in top]
+
+    def save(self, path=BM25_INDEX_PATH):
+        """
+        Writes the indexed documents to {path}. Postings are rebuilt on
+        load, which takes well under a second for the catalog.
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'k1': self.k1, 'b': self.b,
+                       'documents': [{'page_content': doc.page_content,
+                                      'metadata': doc.metadata}
+                                     for doc in self.documents]}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=BM25_INDEX_PATH):
+        """
+        Index saved by the flow, or None if it has not written one.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            saved = json.load(f)
+        documents = [Document(page_content=doc['page_content'], metadata=doc['metadata'])
+                     for doc in saved['documents']]
+        return cls(documents, k1=saved['k1'], b=saved['b'])
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=60):
+    """
+    Merges several ranked lists of documents into one with reciprocal rank
+    fusion. A film found by more than one ranking appears once, with its
+    scores summed.
+
+    parameters:
+    rankings (list of list of Document): Ranked results, best first
+    top_k (int): Number of documents to return
+    k (int): Rank offset; larger values flatten the weight of top ranks
+
+    returns:
+    list of Document: The fused ranking
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.metadata.get(ID_FIELD, doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [documents[key] for key in best]
@@ -0,0 +1,73 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CATALOG_PATH = './data/catalog.parquet'
+
+# One row per film. List fields are real list columns, so nothing has to be
+# re-split downstream.
+SCHEMA = pa.schema([
+    ('TMDB ID', pa.string()),
+    ('Title', pa.string()),
+    ('Runtime (minutes)', pa.int32()),
+    ('Language', pa.string()),
+    ('Overview', pa.string()),
+    ('Release Year', pa.int32()),
+    ('Genre', pa.list_(pa.string())),
+    ('Keywords', pa.list_(pa.string())),
+    ('Actors', pa.list_(pa.string())),
+    ('Directors', pa.list_(pa.string())),
+    ('Stream', pa.list_(pa.string())),
+    ('Buy', pa.list_(pa.string())),
+    ('Rent', pa.list_(pa.string())),
+    ('Production Companies', pa.list_(pa.string())),
+    ('Rating', pa.float64()),
+])
+
+
+def write_catalog(records, path=CATALOG_PATH):
+    """
+    Writes the film catalog as a typed Parquet file. The file is written
+    next to {path} and renamed into place, so readers never see a partial
+    catalog.
+
+    parameters:
+    records (iterable of dict): Movie records
+    path (str): Location of the catalog
+
+    returns:
+    int: Number of films written
+    """
+    table = pa.Table.from_pylist(list(records), schema=SCHEMA)
+    tmp_path = f'{path}.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def read_catalog(path=CATALOG_PATH, columns=None):
+    """
+    Loads the film catalog, reading only {columns} if given.
+
+    parameters:
+    path (str): Location of the catalog
+    columns (list of str): Columns to read, defaults to all of them
+
+    returns:
+    pyarrow.Table: The catalog, or an empty table if none has been written
+    """
+    if not os.path.exists(path):
+        schema = SCHEMA if columns is None else pa.schema(
+            [SCHEMA.field(column) for column in columns])
+        return schema.empty_table()
+    return pq.read_table(path, columns=columns)
+
+
+def iter_catalog_records(table, batch_size=1024):
+    """
+    Yields the rows of {table} as record dicts, one batch in memory at a
+    time.
+    """
+    for batch in table.to_batches(max_chunksize=batch_size):
+        yield from batch.to_pylist()
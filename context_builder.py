@@ -0,0 +1,84 @@
+import re
+
+from vector_sync import ID_FIELD
+
+
+def overview(doc):
+    """
+    The overview part of a doc's page content, which is laid out as
+    "Title: ... . Overview: ... Keywords: ...".
+    """
+    match = re.search(r'Overview: (.*?)(?: Keywords: |$)', doc.page_content, re.S)
+    return match.group(1).strip() if match else doc.page_content
+
+
+def render_doc(doc, overview_words=None):
+    """
+    Compact rendering of one film with just the fields the summary prompt
+    asks for. The overview is cut to its first {overview_words} words if
+    given.
+    """
+    text = overview(doc)
+    if overview_words is not None and len(text.split()) > overview_words:
+        text = ' '.join(text.split()[:overview_words]) + '...'
+    metadata = doc.metadata
+    stream = metadata.get('Stream') or []
+    if isinstance(stream, list):
+        stream = ', '.join(stream)
+    runtime = metadata.get('Runtime (minutes)')
+    return '\n'.join([
+        f"Title: {metadata.get('Title', '')}",
+        f"Runtime: {runtime} minutes" if runtime is not None else "Runtime: Unknown",
+        f"Release Year: {metadata.get('Release Year', 'Unknown')}",
+        f"Streaming: {stream.strip() or 'None'}",
+        f"Overview: {text}",
+    ])
+
+
+def fit_doc(doc, max_tokens, count_tokens):
+    """
+    Rendering of {doc} with the longest overview that keeps it within
+    {max_tokens}, or with no overview if even that is over.
+    """
+    low, high = 0, len(overview(doc).split())
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(render_doc(doc, middle)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return render_doc(doc, low)
+
+
+def build_context(docs, max_tokens, count_tokens):
+    """
+    Renders the retrieved films for the summary prompt. Films are kept in
+    retrieval order, repeats are dropped, and films stop being added once
+    the next one would take the context over {max_tokens}. The best film is
+    always kept, with its overview shortened to fit if needed.
+
+    parameters:
+    docs (list of Document): Retrieved films, best first
+    max_tokens (int): Token budget of the whole context
+    count_tokens (callable): Returns the number of tokens in a string
+
+    returns:
+    str: The context, one block per film
+    """
+    blocks, seen, used = [], set(), 0
+    for doc in docs:
+        block = render_doc(doc)
+        key = doc.metadata.get(ID_FIELD, block)
+        if key in seen or block in seen:
+            continue
+        seen.update([key, block])
+
+        tokens = count_tokens(block)
+        if not blocks and tokens > max_tokens:
+            block = fit_doc(doc, max_tokens, count_tokens)
+            tokens = count_tokens(block)
+        elif used + tokens > max_tokens:
+            break
+        blocks.append(block)
+        used += tokens
+    return '\n\n'.join(blocks)
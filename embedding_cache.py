@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of embeddings for one embedding
+    model. Vectors live in a memory-mapped float32 matrix ({model}.f32) and
+    an index file ({model}.index.json) maps the sha256 of each text to its
+    row. Once {max_entries} rows are used, the least recently used row is
+    overwritten.
+
+    parameters:
+    directory (str): Folder holding the cache files
+    model_name (str): Embedding model the vectors came from
+    max_entries (int): Maximum number of cached vectors
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, directory, model_name, max_entries=50000):
+        os.makedirs(directory, exist_ok=True)
+        slug = model_name.replace('/', '_')
+        self.matrix_path = os.path.join(directory, f'{slug}.f32')
+        self.index_path = os.path.join(directory, f'{slug}.index.json')
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        index = {'dimension': None, 'capacity': 0, 'tick': 0, 'entries': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        self.dimension = index['dimension']
+        self.capacity = index['capacity']
+        self._tick = index['tick']
+        # key -> [row, last used tick]
+        self._entries = index['entries']
+        self._matrix = None
+        if self.capacity:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32,
+                                     mode='r+',
+                                     shape=(self.capacity, self.dimension))
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, texts):
+        """
+        Cached vectors for {texts}, with None for every miss.
+        """
+        vectors = []
+        with self._lock:
+            for text in texts:
+                entry = self._entries.get(self.key(text))
+                if entry is None:
+                    vectors.append(None)
+                    continue
+                self._tick += 1
+                entry[1] = self._tick
+                vectors.append(self._matrix[entry[0]].tolist())
+        return vectors
+
+    def put(self, texts, vectors):
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key in self._entries:
+                    row = self._entries[key][0]
+                else:
+                    row = self._allocate_row(len(vector))
+                self._tick += 1
+                self._entries[key] = [row, self._tick]
+                self._matrix[row] = vector
+
+    def _allocate_row(self, dimension):
+        if self.dimension is None:
+            self.dimension = dimension
+        if len(self._entries) < self.capacity:
+            return len(self._entries)
+        if self.capacity < self.max_entries:
+            self._grow(min(max(2 * self.capacity, self.INITIAL_CAPACITY),
+                           self.max_entries))
+            return len(self._entries)
+
+        # Full: evict the least recently used entry and reuse its row
+        lru_key = min(self._entries, key=lambda k: self._entries[k][1])
+        return self._entries.pop(lru_key)[0]
+
+    def _grow(self, capacity):
+        if self._matrix is not None:
+            self._matrix.flush()
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(capacity * self.dimension * 4)
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32,
+                                 mode='r+', shape=(capacity, self.dimension))
+        self.capacity = capacity
+
+    def flush(self):
+        """
+        Persists the matrix and the index. The index goes through a temp file
+        so a crash never leaves it pointing at rows that were not written.
+        """
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            index = {'dimension': self.dimension, 'capacity': self.capacity,
+                     'tick': self._tick, 'entries': self._entries}
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that check an EmbeddingCache before calling {embeddings}, so
+    text that was embedded before never hits the API again.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get(texts)
+        # Embed each distinct missing text once
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None))
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = dict(zip(missing,
+                                   self.embeddings.embed_documents(missing)))
+            self.cache.put(list(new_vectors), list(new_vectors.values()))
+            self.cache.flush()
+            vectors = [new_vectors[text] if vector is None else vector
+                       for text, vector in zip(texts, vectors)]
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get([text])[0]
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.cache.get([text])[0]
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        self.misses += 1
+        vector = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self._store, text, vector)
+        return vector
+
+    def _store(self, text, vector):
+        self.cache.put([text], [vector])
+        self.cache.flush()
+
+
+class QueryEmbeddings(Embeddings):
+    """
+    Embeddings for the chat model's query path. Query vectors are kept in a
+    small in-memory LRU instead of the flow's EmbeddingCache: user queries
+    are mostly one-off, would push catalog vectors out of it, and flushing
+    it on every miss would put a disk write on each request.
+
+    parameters:
+    embeddings (Embeddings): Model that computes the vectors
+    max_entries (int): Maximum number of query vectors kept
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries=1024):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, text):
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def _put(self, text, vector):
+        with self._lock:
+            self._vectors[text] = vector
+            self._vectors.move_to_end(text)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._put(text, vector)
+        return vector
@@ -0,0 +1,143 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+import wandb
+
+FEEDBACK_COLUMNS = ["sentiment", "query", "query_constructor", "context", "response"]
+
+
+class FeedbackLogger:
+    """
+    Process-wide feedback sink. log() only puts the record on a bounded
+    queue; a single worker thread sends records to one long-lived W&B run
+    as a table, in batches of {batch_size} or every {flush_seconds},
+    whichever comes first. Records that cannot be sent, or that arrive
+    while the queue is full, are appended to {spill_path} as JSON lines and
+    resent after the next successful batch. Whatever is queued is flushed
+    when the process exits.
+
+    parameters:
+    project (str): W&B project to log to
+    spill_path (str): Append-only file for records that could not be sent
+    batch_size (int): Records per table logged
+    flush_seconds (float): Longest a record waits in the queue
+    max_queue (int): Records held in memory before spilling to disk
+    init_run (callable): Starts the W&B run, wandb.init by default
+    """
+
+    def __init__(self, project='film-search', spill_path='./data/feedback_spill.jsonl',
+                 batch_size=20, flush_seconds=30, max_queue=1000, init_run=None):
+        self.project = project
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.init_run = init_run or wandb.init
+        self.run = None
+        self.logged = 0
+        self.spilled = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._work, name='feedback-logger',
+                                        daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def log(self, sentiment, query, query_constructor, context, response):
+        record = dict(zip(FEEDBACK_COLUMNS,
+                          [sentiment, query, query_constructor, context, response]))
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._spill([record])
+
+    def _work(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+        # Drain what was queued before close()
+        records = self._drain()
+        for i in range(0, len(records), self.batch_size):
+            self._send(records[i:i + self.batch_size])
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(timeout, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _send(self, batch):
+        try:
+            self._log_table(batch)
+        except Exception as e:
+            print(f"Could not log feedback, spilling {len(batch)} records: {e}")
+            self._spill(batch)
+            return
+        self._resend_spilled()
+
+    def _log_table(self, batch):
+        if self.run is None:
+            self.run = self.init_run(project=self.project,
+                                     name=f"feedback: {datetime.datetime.now()}")
+        table = wandb.Table(columns=FEEDBACK_COLUMNS,
+                            data=[[record[column] for column in FEEDBACK_COLUMNS]
+                                  for record in batch])
+        self.run.log({"Query Log": table})
+        self.logged += len(batch)
+
+    def _spill(self, records):
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+            self.spilled += len(records)
+
+    def _resend_spilled(self):
+        # The spill file is moved aside first, so records spilled meanwhile
+        # go to a fresh file and nothing is sent twice
+        resend_path = f'{self.spill_path}.resend'
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, resend_path)
+        with open(resend_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        try:
+            for i in range(0, len(records), self.batch_size):
+                self._log_table(records[i:i + self.batch_size])
+        except Exception:
+            self._spill(records[i:])
+        os.remove(resend_path)
+
+    def close(self, timeout=10):
+        """
+        Sends everything still queued and finishes the run.
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._worker.join(timeout)
+        if self.run is not None:
+            self.run.finish()
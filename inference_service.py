@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import json
+
+import requests
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def sse_event(event, data):
+    """
+    One server-sent event. Data is JSON encoded, so answer chunks with
+    newlines stay inside a single event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(model, query):
+    """
+    Streams the answer to {query} as events: the structured query and the
+    context as soon as they are known, then each answer chunk, then done.
+    """
+    state, sent = {}, set()
+    async for chunk in model.apredict_stream(query, state):
+        for key in ('query_constructor', 'context'):
+            if key in state and key not in sent:
+                sent.add(key)
+                yield sse_event(key, state[key])
+        yield sse_event('answer', chunk)
+    for key in ('query_constructor', 'context'):
+        if key in state and key not in sent:
+            yield sse_event(key, state[key])
+    yield sse_event('done', {})
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls {release} once it has been sent, or failed
+    to be, so a request's concurrency slot is freed even when the client
+    disconnects before the body starts.
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+def create_app(model=None, config=None):
+    """
+    ASGI app serving recommendations from one warm rosebud_chat_model.
+
+    POST /recommend with {"query": ...} streams server-sent events and
+    GET /metrics returns the model's per-stage latency percentiles. At most
+    "service_max_concurrency" requests are answered at once; a request that
+    cannot get a slot within "service_queue_timeout_seconds" gets a 503, so
+    load is pushed back to clients instead of piling up.
+
+    parameters:
+    model (rosebud_chat_model): Model to serve, built at startup if None
+    config (dict): Service settings, read from config.json if None
+    """
+    if config is None:
+        with open('./config.json') as f:
+            config = json.load(f)
+    slots = asyncio.Semaphore(config['service_max_concurrency'])
+    queue_timeout = config['service_queue_timeout_seconds']
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        if model is None:
+            # Imported here so the module loads without the model's
+            # dependencies, e.g. for a client
+            from rosebud_chat_model import rosebud_chat_model
+            from tracing import init_tracing
+            init_tracing(config['tracing_project'], config['tracing_sample_rate'])
+            app.state.model = await asyncio.to_thread(rosebud_chat_model)
+        yield
+
+    async def recommend(request):
+        body = await request.json()
+        query = (body.get('query') or '').strip()
+        if not query:
+            return JSONResponse({'error': 'query is required'}, status_code=400)
+
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            return JSONResponse({'error': 'too many requests in flight'},
+                                status_code=503,
+                                headers={'Retry-After': str(max(1, round(queue_timeout)))})
+
+        return SlotStreamingResponse(
+            stream_events(request.app.state.model, query), slots.release,
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache'})
+
+    async def health(request):
+        return JSONResponse({'status': 'ok'})
+
+    async def metrics(request):
+        return JSONResponse(request.app.state.model.latency_metrics.snapshot())
+
+    app = Starlette(routes=[Route('/recommend', recommend, methods=['POST']),
+                            Route('/health', health),
+                            Route('/metrics', metrics)],
+                    lifespan=lifespan)
+    if model is not None:
+        app.state.model = model
+    return app
+
+
+def iter_events(lines):
+    """
+    Parses server-sent event lines into (event, data) pairs.
+    """
+    event, data = None, []
+    for line in lines:
+        if line:
+            field, _, value = line.partition(': ')
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data.append(value)
+        elif event is not None:
+            yield event, json.loads('\n'.join(data))
+            event, data = None, []
+
+
+def recommend_stream(url, query, state=None, timeout=120):
+    """
+    Client for /recommend with the same interface as predict_stream: yields
+    answer chunks and writes the structured query and context to {state}.
+    """
+    if state is None:
+        state = {}
+    with requests.post(f"{url.rstrip('/')}/recommend", json={'query': query},
+                       stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for event, data in iter_events(response.iter_lines(decode_unicode=True)):
+            if event == 'answer':
+                yield data
+            elif event in ('query_constructor', 'context'):
+                state[event] = data
+
+
+app = create_app()
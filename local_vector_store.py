@@ -0,0 +1,212 @@
+import json
+import os
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from metadata_index import MetadataIndex
+
+LOCAL_STORE_DIR = './data/local_store'
+VECTORS_FILE = 'vectors.npy'
+DOCUMENTS_FILE = 'documents.json'
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def _compare(value, operator, operand):
+    """
+    Applies one Pinecone comparator to a single metadata value. List values
+    match the way Pinecone matches them: $eq and $in if any element
+    matches, $ne and $nin if no element does.
+    """
+    values = value if isinstance(value, list) else [value]
+    if operator == '$eq':
+        return operand in values
+    if operator == '$ne':
+        return operand not in values
+    if operator == '$in':
+        return any(v in operand for v in values)
+    if operator == '$nin':
+        return not any(v in operand for v in values)
+
+    if isinstance(value, list) or isinstance(value, str):
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise ValueError(f'Unsupported filter operator {operator}')
+
+
+def matches_filter(metadata, filter):
+    """
+    Evaluates a Pinecone metadata filter, as produced by PineconeTranslator,
+    against one document's metadata. MetadataIndex evaluates the same
+    semantics over every document at once. Films missing a field only match the
+    negative comparators, $ne and $nin.
+    """
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, f) for f in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, f) for f in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                if key not in metadata:
+                    if operator not in ('$ne', '$nin'):
+                        return False
+                elif not _compare(metadata[key], operator, operand):
+                    return False
+    return True
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store over a matrix of unit-length embeddings, one row
+    per document. A search is one matrix-vector product plus a partial sort,
+    with Pinecone filter semantics, so the chat model can run without a
+    network hop to Pinecone.
+
+    parameters:
+    embedding (Embeddings): Model used to embed queries
+    vectors (np.ndarray): Unit-length document embeddings, one row per doc
+    documents (list of Document): Documents in row order
+    """
+
+    def __init__(self, embedding: Embeddings, vectors, documents: List[Document]):
+        if len(vectors) != len(documents):
+            raise ValueError(f'{len(vectors)} vectors for {len(documents)} documents')
+        self._embedding = embedding
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.documents = documents
+        self.metadata_index = MetadataIndex([doc.metadata for doc in documents])
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @classmethod
+    def load(cls, embedding: Embeddings, directory=LOCAL_STORE_DIR):
+        """
+        Opens a store written by save(). The matrix is memory-mapped, so
+        start-up does not read it into memory up front.
+        """
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(directory, DOCUMENTS_FILE)) as f:
+            documents = [Document(page_content=doc['page_content'],
+                                  metadata=doc['metadata'])
+                         for doc in json.load(f)]
+        return cls(embedding, vectors, documents)
+
+    @staticmethod
+    def save(vectors, documents, directory=LOCAL_STORE_DIR):
+        """
+        Writes {vectors} and {documents} to {directory}. Each file goes
+        through a temp file, so a reader never sees a partial one.
+        """
+        os.makedirs(directory, exist_ok=True)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        with open(f'{vectors_path}.tmp', 'wb') as f:
+            np.save(f, _normalize(vectors))
+        os.replace(f'{vectors_path}.tmp', vectors_path)
+
+        documents_path = os.path.join(directory, DOCUMENTS_FILE)
+        with open(f'{documents_path}.tmp', 'w') as f:
+            json.dump([{'page_content': doc.page_content, 'metadata': doc.metadata}
+                       for doc in documents], f)
+        os.replace(f'{documents_path}.tmp', documents_path)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = _normalize(self._embedding.embed_documents(texts))
+        start = len(self.documents)
+        self.vectors = np.vstack([self.vectors, vectors]) if start else vectors
+        self.documents.extend(Document(page_content=text, metadata=metadata)
+                              for text, metadata in zip(texts, metadatas))
+        self.metadata_index = MetadataIndex([doc.metadata for doc in self.documents])
+        return [str(i) for i in range(start, len(self.documents))]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        store = cls(embedding, np.empty((0, 0), dtype=np.float32), [])
+        store.add_texts(texts, metadatas)
+        return store
+
+    def candidate_rows(self, filter: Optional[dict]):
+        """
+        Rows whose metadata passes {filter}, or None for every row.
+        """
+        if not filter:
+            return None
+        return np.flatnonzero(self.metadata_index.evaluate(filter))
+
+    def count(self, filter: Optional[dict] = None):
+        """
+        Number of documents matching {filter}, without a vector search.
+        """
+        if not filter:
+            return len(self.documents)
+        return self.metadata_index.count(filter)
+
+    def similarity_search_by_vector_with_score(
+            self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+            **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self._search(embedding, self.candidate_rows(filter), k)
+
+    def _search(self, embedding, rows, k):
+        if rows is None:
+            scores = self.vectors @ _normalize(embedding)
+        else:
+            scores = self.vectors[rows] @ _normalize(embedding)
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        if rows is not None:
+            return [(self.documents[rows[i]], float(scores[i])) for i in top]
+        return [(self.documents[i], float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        # Only the films passing the filter are scored, and a filter nothing
+        # passes returns before the query is embedded
+        rows = self.candidate_rows(filter)
+        if rows is not None and not len(rows):
+            return []
+        return self._search(self._embedding.embed_query(query), rows, k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(
+            embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(
+            query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1], as with Pinecone
+        return lambda score: (score + 1) / 2
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class MetadataIndex:
+    """
+    Columnar index over document metadata for evaluating Pinecone filters
+    without visiting every document. String and list fields get a posting
+    list of rows per value; numeric fields get their values sorted once, so
+    a range comparison is two binary searches. A filter evaluates to a
+    boolean mask over the rows, with the same semantics as matches_filter.
+
+    parameters:
+    metadatas (list of dict): Metadata of each document, in row order
+    """
+
+    def __init__(self, metadatas):
+        self.size = len(metadatas)
+        self.postings = {}
+        self.numeric = {}
+
+        numeric_values = {}
+        present = {}
+        for row, metadata in enumerate(metadatas):
+            for field, value in metadata.items():
+                present.setdefault(field, []).append(row)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numeric_values.setdefault(field, []).append((value, row))
+                    continue
+                postings = self.postings.setdefault(field, {})
+                for item in (value if isinstance(value, list) else [value]):
+                    postings.setdefault(item, []).append(row)
+
+        self.postings = {field: {value: np.array(rows, dtype=np.int64)
+                                 for value, rows in values.items()}
+                         for field, values in self.postings.items()}
+        # field -> (sorted values, rows in that order)
+        for field, pairs in numeric_values.items():
+            pairs.sort()
+            self.numeric[field] = (np.array([value for value, _ in pairs], dtype=np.float64),
+                                   np.array([row for _, row in pairs], dtype=np.int64))
+        self.present = {field: np.array(rows, dtype=np.int64)
+                        for field, rows in present.items()}
+
+    def _mask(self, rows=None):
+        mask = np.zeros(self.size, dtype=bool)
+        if rows is not None:
+            mask[rows] = True
+        return mask
+
+    def _equal(self, field, value):
+        if field in self.numeric and isinstance(value, (int, float)):
+            values, rows = self.numeric[field]
+            return self._mask(rows[np.searchsorted(values, value, 'left'):
+                                   np.searchsorted(values, value, 'right')])
+        return self._mask(self.postings.get(field, {}).get(value))
+
+    def _range(self, field, operator, value):
+        if field not in self.numeric or isinstance(value, str):
+            return self._mask()
+        values, rows = self.numeric[field]
+        if operator == '$gt':
+            return self._mask(rows[np.searchsorted(values, value, 'right'):])
+        if operator == '$gte':
+            return self._mask(rows[np.searchsorted(values, value, 'left'):])
+        if operator == '$lt':
+            return self._mask(rows[:np.searchsorted(values, value, 'left')])
+        if operator == '$lte':
+            return self._mask(rows[:np.searchsorted(values, value, 'right')])
+        raise ValueError(f'Unsupported filter operator {operator}')
+
+    def _compare(self, field, operator, operand):
+        if operator == '$eq':
+            return self._equal(field, operand)
+        if operator == '$ne':
+            return ~self._equal(field, operand)
+        if operator in ('$in', '$nin'):
+            mask = self._mask()
+            for value in operand:
+                mask |= self._equal(field, value)
+            return mask if operator == '$in' else ~mask
+        return self._range(field, operator, operand)
+
+    def evaluate(self, filter):
+        """
+        Boolean mask of the rows matching {filter}.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for key, condition in filter.items():
+            if key == '$and':
+                for f in condition:
+                    mask &= self.evaluate(f)
+            elif key == '$or':
+                any_mask = self._mask()
+                for f in condition:
+                    any_mask |= self.evaluate(f)
+                mask &= any_mask
+            else:
+                if not isinstance(condition, dict):
+                    condition = {'$eq': condition}
+                for operator, operand in condition.items():
+                    mask &= self._compare(key, operator, operand)
+        return mask
+
+    def count(self, filter):
+        """
+        Number of documents matching {filter}.
+        """
+        return int(np.count_nonzero(self.evaluate(filter)))
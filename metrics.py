@@ -0,0 +1,108 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Latencies are recorded in seconds, tokens_per_second in tokens per second
+PIPELINE_STAGES = ['query_constructor', 'retrieval', 'format_context',
+                   'first_token', 'last_token', 'tokens_per_second']
+# Stages where a higher value is better
+RATE_STAGES = ['tokens_per_second']
+
+
+class _Span:
+    """
+    Times the block it wraps with perf_counter and records the elapsed
+    seconds. A plain class rather than contextlib.contextmanager, which
+    costs a generator per span.
+    """
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class LatencyMetrics:
+    """
+    In-process latency histograms, one per pipeline stage. Each stage keeps
+    its last {max_samples} values, so percentiles follow recent traffic and
+    memory stays bounded. Recording a value is a lock and a deque append;
+    percentiles are only computed when a snapshot is taken.
+
+    parameters:
+    max_samples (int): Values kept per stage
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        """
+        Context manager recording how long its block took under {name}.
+        """
+        return _Span(self, name)
+
+    def record(self, name, value):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = collections.deque(maxlen=self.max_samples)
+            samples.append(value)
+            self._counts[name] += 1
+
+    def snapshot(self):
+        """
+        Summary of every stage recorded so far.
+
+        returns:
+        dict: Stage name to count, mean, p50, p95, p99 and max
+        """
+        with self._lock:
+            samples = {name: np.array(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for name, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[name] = {
+                'count': counts[name],
+                'mean': float(values.mean()),
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+                'max': float(values.max()),
+            }
+        return summary
+
+    def dump(self, path):
+        """
+        Writes the snapshot to {path} as JSON.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+# Shared by every model in the process, so the Streamlit app and the
+# inference service report one set of histograms
+pipeline_metrics = LatencyMetrics()
@@ -1,87 +1,170 @@
 import weave
 import asyncio
+import hashlib
+import math
 from ragas import evaluate
 from ragas.metrics import AnswerRelevancy, ContextRelevancy, Faithfulness
+from ragas.run_config import RunConfig
 from datasets import Dataset
 from rosebud_chat_model import rosebud_chat_model
-import os
+from query_cache import PersistentLRUCache
+from tracing import init_tracing
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
 import json
 
-# Set environment variable to limit parallel workers
-os.environ['WEAVE_PARALLELISM'] = '3'
-
 with open('./config.json') as f:
     config = json.load(f)
 
+METRIC_NAMES = ['answer_relevancy', 'context_relevancy', 'faithfulness']
+
+# Evaluation questions, one per kind of query users ask
+QUESTIONS = [
+    {"query": "Suggest a good movie based on a book."},  # Adaptations
+    {"query": "Suggest a film for a cozy night in."},  # Mood-Based
+    {"query": "What are some must-watch horror movies?"},  # Genre-Specific
+    {"query": "Recommend a film about overcoming adversity."},  # Theme-Based
+    {"query": "Can you suggest a movie set in ancient Rome?"},  # Setting-Based
+    {"query": "What are some essential movies to watch in the Marvel Cinematic Universe?"},  # Franchise Films
+    {"query": "What are some lesser-known indie films worth watching?"},  # Indie Films
+    {"query": "What's a good starting point if I want to explore Japanese cinema?"},  # Cultural Films
+    {"query": "What's a good movie for a group with varied tastes?"},  # Contextual
+    {"query": "I loved Inception and The Matrix. What should I watch next?"},  # Preference-Based
+    {"query": "What are some highly rated documentary films?"},  # Ratings based
+    {"query": "I'm looking for a good horror movie from the 1970s."},  # Year-Based
+    {"query": "Can you suggest a good movie set in the 1980s?"},  # Era-Specific
+    {"query": "What are some great Christmas movies?"},  # Seasonal
+    {"query": "Recommend a movie that is set in the future."},  # Future-Set Films
+    {"query": "Suggest a movie that blends horror and science fiction."},  # Multi-Genre
+    {"query": "Recommend a film with a strong female lead."},  # Character-Based
+    {"query": "Can you suggest a movie with a surprising twist at the end?"},  # Plot-Specific
+    {"query": "Can you suggest a film with Leonardo DiCaprio in the lead role?"},  # Actor-Specific
+    {"query": "I want some fantasy movies featuring dragons that are under 90 minutes long."}  # Multi-criteria
+]
+
+
+def drop_inputs(*names):
+    """
+    Keeps arguments such as clients out of the inputs Weave logs for an op.
+    """
+    return lambda inputs: {key: value for key, value in inputs.items() if key not in names}
+
+
+class RagasJudge:
+    """
+    Scores model outputs with RAGAS. The judge LLM, the embeddings and the
+    metrics are built once and shared by every evaluation run in the
+    process, and all rows not scored before are judged in one RAGAS run.
+    Scores are cached by a hash of the question, answer and context, so
+    re-running an evaluation, or a variant that gives the same answer,
+    makes no judge calls for those rows. The cache file is written once per
+    scored batch.
+
+    parameters:
+    judge_model_name (str): Chat model the RAGAS metrics use
+    embedding_model_name (str): Embedding model AnswerRelevancy uses
+    cache_path (str): JSON file scores persist to, or None to keep them in memory
+    max_workers (int): Judge requests in flight at once
+    llm: Judge model, built from {judge_model_name} if None
+    embeddings: Embeddings, built from {embedding_model_name} if None
+    """
+
+    def __init__(self, judge_model_name, embedding_model_name, cache_path=None,
+                 max_workers=16, llm=None, embeddings=None):
+        self.llm = llm or ChatOpenAI(model=judge_model_name)
+        self.embeddings = embeddings or OpenAIEmbeddings(model=embedding_model_name)
+        self.metrics = [AnswerRelevancy(), ContextRelevancy(), Faithfulness()]
+        self.run_config = RunConfig(max_workers=max_workers)
+        # Scores only carry over while the judge and metrics stay the same
+        self.cache = PersistentLRUCache(
+            path=cache_path,
+            fingerprint=':'.join([judge_model_name, embedding_model_name] + METRIC_NAMES))
+
+    @staticmethod
+    def row_key(row):
+        return hashlib.sha1(json.dumps(
+            [row['question'], row['answer'], row['context']]).encode('utf-8')).hexdigest()
+
+    @weave.op(postprocess_inputs=drop_inputs('self'))
+    def score(self, rows):
+        """
+        RAGAS scores for each of {rows}, dicts with a question, an answer and
+        the context it was answered from.
+
+        returns:
+        list of dict: Metric name to score, per row
+        """
+        keys = [self.row_key(row) for row in rows]
+        scores = {key: self.cache.get(key) for key in keys}
+        pending = {key: row for key, row in zip(keys, rows) if scores[key] is None}
+
+        if pending:
+            dataset = Dataset.from_dict({
+                "question": [row['question'] for row in pending.values()],
+                "contexts": [[row['context']] for row in pending.values()],
+                "answer": [row['answer'] for row in pending.values()],
+            })
+            # A failed judge call scores NaN for its row instead of failing
+            # the whole batch
+            evaluation = evaluate(dataset=dataset, metrics=self.metrics, llm=self.llm,
+                                  embeddings=self.embeddings, run_config=self.run_config,
+                                  raise_exceptions=False)
+            for key, row_scores in zip(pending, evaluation.scores.to_list()):
+                scores[key] = {name: float(row_scores[name]) for name in METRIC_NAMES}
+                # Rows with a failed metric are judged again next run
+                if not any(math.isnan(value) for value in scores[key].values()):
+                    self.cache.put(key, scores[key])
+            self.cache.save()
+
+        return [scores[key] for key in keys]
+
+
+async def predict_all(model, questions, concurrency):
+    """
+    Answers every question with {model}, {concurrency} at a time.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def predict(question):
+        async with slots:
+            return await model.predict(question['query'])
 
-@weave.op()
-def evaluate_with_ragas(query, model_output):
-    # Put data into a Dataset object
-    data = {
-        "question": [query],
-        "contexts": [[model_output['context']]],
-        "answer": [model_output['answer']]
-    }
-    dataset = Dataset.from_dict(data)
+    return await asyncio.gather(*(predict(question) for question in questions))
 
-    # Define metrics to judge
-    metrics = [
-        AnswerRelevancy(),
-        ContextRelevancy(),
-        Faithfulness(),
-        # harmfulness
-    ]
 
-    judge_model = ChatOpenAI(model=config['JUDGE_MODEL_NAME'])
-    embeddings_model = OpenAIEmbeddings(model=config['EMBEDDING_MODEL_NAME'])
+@weave.op(postprocess_inputs=drop_inputs('judge'))
+def evaluate_model(model, judge, questions=QUESTIONS):
+    """
+    Answers {questions} with {model} and scores every answer with {judge}.
+    Pass the same judge when evaluating several prompt or model variants,
+    so they share its clients and its cache.
 
-    evaluation = evaluate(dataset=dataset, metrics=metrics, llm=judge_model, embeddings=embeddings_model)
+    returns:
+    dict: Mean of each metric, and the per-question rows
+    """
+    outputs = asyncio.run(predict_all(model, questions, config['eval_concurrency']))
+    rows = [{'question': question['query'], 'answer': output['answer'],
+             'context': output['context']} for question, output in zip(questions, outputs)]
+    scores = judge.score(rows)
 
-    return {
-        "answer_relevancy": float(evaluation['answer_relevancy']),
-        "context_relevancy": float(evaluation['context_relevancy']),
-        "faithfulness": float(evaluation['faithfulness']),
-        # "harmfulness": float(evaluation['harmfulness'])
-    }
+    summary = {}
+    for name in METRIC_NAMES:
+        values = [row_scores[name] for row_scores in scores if not math.isnan(row_scores[name])]
+        summary[name] = sum(values) / len(values) if values else float('nan')
+    return {'summary': summary,
+            'rows': [{**row, **row_scores} for row, row_scores in zip(rows, scores)]}
 
 
 def run_evaluation():
-    # Initialize chat model
-    model = rosebud_chat_model()
-
-    # Define evaluation questions
-    questions = [
-        {"query": "Suggest a good movie based on a book."},  # Adaptations
-        {"query": "Suggest a film for a cozy night in."},  # Mood-Based
-        {"query": "What are some must-watch horror movies?"},  # Genre-Specific
-        {"query": "Recommend a film about overcoming adversity."},  # Theme-Based
-        {"query": "Can you suggest a movie set in ancient Rome?"},  # Setting-Based
-        {"query": "What are some essential movies to watch in the Marvel Cinematic Universe?"},  # Franchise Films
-        {"query": "What are some lesser-known indie films worth watching?"},  # Indie Films
-        {"query": "What's a good starting point if I want to explore Japanese cinema?"},  # Cultural Films
-        {"query": "What's a good movie for a group with varied tastes?"},  # Contextual
-        {"query": "I loved Inception and The Matrix. What should I watch next?"},  # Preference-Based
-        {"query": "What are some highly rated documentary films?"},  # Ratings based
-        {"query": "I'm looking for a good horror movie from the 1970s."},  # Year-Based
-        {"query": "Can you suggest a good movie set in the 1980s?"},  # Era-Specific
-        {"query": "What are some great Christmas movies?"},  # Seasonal
-        {"query": "Recommend a movie that is set in the future."},  # Future-Set Films
-        {"query": "Suggest a movie that blends horror and science fiction."},  # Multi-Genre
-        {"query": "Recommend a film with a strong female lead."},  # Character-Based
-        {"query": "Can you suggest a movie with a surprising twist at the end?"},  # Plot-Specific
-        {"query": "Can you suggest a film with Leonardo DiCaprio in the lead role?"},  # Actor-Specific
-        {"query": "I want some fantasy movies featuring dragons that are under 90 minutes long."}  # Multi-criteria
-    ]
-
-    # Create Weave Evaluation object
-    evaluation = weave.Evaluation(dataset=questions, scorers=[evaluate_with_ragas])
-
-    # Run the evaluation
-    asyncio.run(evaluation.evaluate(model))
+    judge = RagasJudge(config['JUDGE_MODEL_NAME'], config['EMBEDDING_MODEL_NAME'],
+                       cache_path=config['judge_cache_path'],
+                       max_workers=config['judge_concurrency'])
+    result = evaluate_model(rosebud_chat_model(), judge)
+    print(json.dumps(result['summary'], indent=2))
+    print(f"Judge cache: {judge.cache.stats()}")
 
 
 if __name__ == "__main__":
-    weave.init('film-search')
+    # Every evaluation call is traced, whatever the production sample rate
+    init_tracing(config['tracing_project'], sample_rate=1.0)
     run_evaluation()
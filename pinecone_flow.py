@@ -1,13 +1,8 @@
 # Pinecone
 from pinecone import Pinecone, ServerlessSpec
-from pinecone.core.client.exceptions import NotFoundException
 
 # Langchain
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain.chains.query_constructor.base import AttributeInfo
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 
 # Prefect
 from prefect import task, flow
@@ -20,9 +15,30 @@ from weave import Dataset
 # General
 import os
 from dotenv import load_dotenv
-import csv
-from utils import get_id_list, get_data, write_file
+from utils import RateLimiter, ResponseCache, TMDBClient
+from refresh import (empty_manifest, incremental_refresh, iter_year_records,
+                     load_manifest, save_manifest)
+from records import DOCUMENT_FIELDS, export_csv, iter_documents
+from catalog import (CATALOG_PATH, iter_catalog_records, read_catalog,
+                     write_catalog)
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from local_vector_store import LocalVectorStore
+from bm25_index import BM25Index
+from vector_sync import (HASH_FIELD, catalog_version, delete_ids, doc_hash,
+                         doc_id, fetch_indexed_hashes, plan_sync,
+                         write_catalog_version)
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tiktoken
+
+# Key PineconeVectorStore reads the page content back from
+TEXT_KEY = "text"
+
+# Catalog columns published to Weave
+WEAVE_FIELDS = ['Title', 'Runtime (minutes)', 'Language', 'Overview',
+                'Release Year', 'Genre', 'Keywords', 'Actors', 'Directors',
+                'Stream', 'Buy', 'Rent', 'Production Companies', 'Rating']
 
 
 @task
@@ -52,122 +68,133 @@ def start():
 
 
 @task(retries=3, retry_delay_seconds=[1, 10, 100])
-def pull_data_to_csv(config):
+def update_catalog(config):
     TMBD_API_KEY = os.getenv('TMBD_API_KEY')
     YEARS = range(config["years"][0], config["years"][-1] + 1)
-    CSV_HEADER = ['Title', 'Runtime (minutes)', 'Language', 'Overview',
-                  'Release Year', 'Genre', 'Keywords',
-                  'Actors', 'Directors', 'Stream', 'Buy', 'Rent',
-                  'Production Companies', 'Rating']
 
-    for year in YEARS:
-        # Grab list of ids for all films made in {YEAR}
-        movie_list = list(set(get_id_list(TMBD_API_KEY, year)))
+    # Responses fetched by a failed attempt are reused by the retry
+    cache = ResponseCache(
+        config["tmdb_cache_dir"],
+        ttls={path: hours * 60 * 60
+              for path, hours in config["tmdb_cache_ttl_hours"].items()},
+        max_bytes=config["tmdb_cache_max_mb"] * 1024 * 1024,
+        offline=config["tmdb_offline"])
+
+    # Fan out discover and detail calls over one pooled, rate-limited client
+    client = TMDBClient(TMBD_API_KEY,
+                        rate_limiter=RateLimiter(
+                            rate=config["tmdb_requests_per_second"]),
+                        pool_size=config["tmdb_max_workers"],
+                        cache=cache)
+
+    # Only re-fetch what is new, changed on TMDB or stale. A full refresh is
+    # an incremental refresh against an empty manifest and catalog.
+    if config["incremental_refresh"]:
+        manifest = load_manifest()
+        records = {record['TMDB ID']: record
+                   for record in iter_catalog_records(read_catalog())}
+    else:
+        manifest, records = empty_manifest(), {}
+    policy = {'recent_years': config["refresh_recent_years"],
+              'recent_max_age_days': config["refresh_recent_max_age_days"],
+              'max_age_days': config["refresh_max_age_days"]}
+    dirty_years = incremental_refresh(client, YEARS, manifest, records, policy,
+                                      max_workers=config["tmdb_max_workers"])
 
-        FILE_NAME = f'./data/{year}_movie_collection_data.csv'
+    print(f"TMDB client stats: {client.stats()}")
+    client.close()
 
-        # Creating file
-        with open(FILE_NAME, 'w') as f:
-            writer = csv.writer(f)
-            writer.writerow(CSV_HEADER)
+    num_films = write_catalog(record for year in YEARS
+                              for record in iter_year_records(manifest, records, year))
+    save_manifest(manifest)
 
-        # Iterate through list of ids to get data
-        for id in movie_list:
-            dict = get_data(TMBD_API_KEY, id)
-            write_file(FILE_NAME, dict)
+    # CSV is only an export of the catalog, not part of the pipeline
+    if config["export_csv"]:
+        for year in YEARS:
+            FILE_NAME = f'./data/{year}_movie_collection_data.csv'
 
-    print("Successfully pulled data from TMDB and created csv files in data/")
+            # Only rewrite the files of years whose records changed
+            if year in dirty_years or not os.path.exists(FILE_NAME):
+                export_csv(FILE_NAME, iter_year_records(manifest, records, year))
 
+    print(f"Successfully wrote {num_films} films to {CATALOG_PATH} "
+          f"({len(dirty_years)} of {len(YEARS)} years changed)")
 
-@task
-def convert_csv_to_docs():
-    # Loading in data from all csv files
-    loader = DirectoryLoader(
-        path="./data",
-        glob="*.csv",
-        loader_cls=CSVLoader,
-        show_progress=True)
-
-    docs = loader.load()
-
-    metadata_field_info = [
-        AttributeInfo(name="Title",
-                      description="The title of the movie", type="string"),
-        AttributeInfo(name="Runtime (minutes)",
-                      description="The runtime of the movie in minutes", type="integer"),
-        AttributeInfo(name="Language",
-                      description="The language of the movie", type="string"),
-        AttributeInfo(name="Release Year",
-                      description="The release year of the movie as an integer", type="integer"),
-        AttributeInfo(name="Genre",
-                      description="The genre of the movie", type="string or list[string]"),
-        AttributeInfo(name="Actors",
-                      description="The actors in the movie", type="string or list[string]"),
-        AttributeInfo(name="Directors",
-                      description="The directors of the movie", type="string or list[string]"),
-        AttributeInfo(name="Stream",
-                      description="The streaming platforms for the movie", type="string or list[string]"),
-        AttributeInfo(name="Buy",
-                      description="The platforms where the movie can be bought", type="string or list[string]"),
-        AttributeInfo(name="Rent",
-                      description="The platforms where the movie can be rented",
-                      type="string or list[string]"),
-        AttributeInfo(name="Production Companies",
-                      description="The production companies of the movie", type="string or list[string]"),
-        AttributeInfo(name="Rating",
-                      description="Rating of a film, out of 10", type="float"),
-    ]
-
-    def convert_to_list(doc, field):
-        if field in doc.metadata and doc.metadata[field] is not None:
-            doc.metadata[field] = [item.strip()
-                                   for item in doc.metadata[field].split(',')]
-
-    def convert_to_int(doc, field):
-        if field in doc.metadata and doc.metadata[field] is not None:
-            doc.metadata[field] = int(
-                doc.metadata[field])
-
-    def convert_to_float(doc, field):
-        if field in doc.metadata and doc.metadata[field] is not None:
-            doc.metadata[field] = float(
-                doc.metadata[field])
-
-    fields_to_convert_list = ['Genre', 'Actors', 'Directors',
-                              'Production Companies', 'Stream', 'Buy', 'Rent']
-    fields_to_convert_int = ['Runtime (minutes)', 'Release Year']
-    fields_to_convert_float = ['Rating']
-
-    # Set 'overview' and 'keywords' as 'page_content' and other fields as 'metadata'
-    for doc in docs:
-        # Parse the page_content string into a dictionary
-        page_content_dict = dict(line.split(": ", 1)
-                                 for line in doc.page_content.split("\n") if ": " in line)
-
-        doc.page_content = (
-            'Title: ' + page_content_dict.get('Title') +
-            '. Overview: ' + page_content_dict.get('Overview') +
-            ' Keywords: ' + page_content_dict.get('Keywords')
-        )
+    return CATALOG_PATH
 
-        doc.metadata = {field.name: page_content_dict.get(
-            field.name) for field in metadata_field_info}
 
-        # Convert fields from string to list of strings
-        for field in fields_to_convert_list:
-            convert_to_list(doc, field)
+@task
+def convert_catalog_to_docs(catalog_path):
+    table = read_catalog(catalog_path, columns=DOCUMENT_FIELDS)
+    docs = list(iter_documents(iter_catalog_records(table)))
+    print("Successfully took the film catalog and created docs")
 
-        # Convert fields from string to integers
-        for field in fields_to_convert_int:
-            convert_to_int(doc, field)
+    return docs
 
-        # Convert fields from string to floats
-        for field in fields_to_convert_float:
-            convert_to_float(doc, field)
 
-    print("Successfully took csv files and created docs")
+def batch_by_tokens(docs, max_tokens, max_size, count_tokens):
+    """
+    Splits {docs} into embedding batches of at most {max_size} docs and
+    {max_tokens} tokens of page content.
+    """
+    batch, batch_tokens = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def embed_and_upsert(docs, embeddings, pc_index, namespace, config,
+                     count_tokens=None):
+    """
+    Embeds {docs} in token-aware batches, several batches at a time, and
+    streams the vectors into parallel Pinecone upserts as each embedding
+    batch completes. Batch sizes and concurrency come from config.json.
 
-    return docs
+    returns:
+    float: Throughput in vectors per second
+    """
+    if count_tokens is None:
+        encoding = tiktoken.encoding_for_model(config['EMBEDDING_MODEL_NAME'])
+
+        def count_tokens(text):
+            return len(encoding.encode(text))
+
+    def embed(batch):
+        return batch, embeddings.embed_documents([doc.page_content for doc in batch])
+
+    def upsert(vectors):
+        pc_index.upsert(vectors=vectors, namespace=namespace,
+                        show_progress=False)
+        return len(vectors)
+
+    start_time = time.perf_counter()
+    batches = batch_by_tokens(docs, config['embedding_batch_tokens'],
+                              config['embedding_batch_size'], count_tokens)
+    upsert_size = config['upsert_batch_size']
+
+    with ThreadPoolExecutor(config['embedding_concurrency']) as embed_pool, \
+            ThreadPoolExecutor(config['upsert_concurrency']) as upsert_pool:
+        upserts = []
+        for batch, vectors in embed_pool.map(embed, batches):
+            records = [{'id': doc_id(doc), 'values': vector,
+                        'metadata': {**doc.metadata, TEXT_KEY: doc.page_content,
+                                     HASH_FIELD: doc_hash(doc)}}
+                       for doc, vector in zip(batch, vectors)]
+            for i in range(0, len(records), upsert_size):
+                upserts.append(upsert_pool.submit(upsert, records[i:i + upsert_size]))
+        upserted = sum(future.result() for future in upserts)
+
+    elapsed = time.perf_counter() - start_time
+    throughput = upserted / elapsed if elapsed else 0.0
+    print(f"Embedded and upserted {upserted} vectors in {elapsed:.1f}s "
+          f"({throughput:.1f} vectors/second)")
+    return throughput
 
 
 @task
@@ -192,50 +219,105 @@ def upload_docs_to_pinecone(docs, config):
     pc_index = pc.Index(PINECONE_INDEX_NAME)
     print(pc_index.describe_index_stats())
 
-    embeddings = OpenAIEmbeddings(model=config['EMBEDDING_MODEL_NAME'])
+    # Text embedded in an earlier run is served from the on-disk cache
+    embeddings = CachedEmbeddings(
+        OpenAIEmbeddings(model=config['EMBEDDING_MODEL_NAME']),
+        EmbeddingCache(config['embedding_cache_dir'],
+                       config['EMBEDDING_MODEL_NAME'],
+                       max_entries=config['embedding_cache_max_entries']))
     namespace = "film_search_prod"
 
-    try:
-        pc_index.delete(namespace=namespace, delete_all=True)
-    except NotFoundException:
-        print(f"Namespace '{namespace}' not found. Not deleting.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    else:
-        print("Namespace deleted successfully.")
+    # Only embed and write the films that are new or changed, judged by the
+    # content hash stored with each vector. Upserting before deleting means
+    # the namespace is never empty mid-flow.
+    synced_hashes = fetch_indexed_hashes(pc_index, namespace)
+    to_upsert, to_delete = plan_sync(docs, synced_hashes)
+    print(f"Upserting {len(to_upsert)} and deleting {len(to_delete)} "
+          f"of {len(docs)} docs")
 
-    PineconeVectorStore.from_documents(
-        docs,
-        index_name=PINECONE_INDEX_NAME,
-        embedding=embeddings,
-        namespace=namespace
-    )
+    if to_upsert:
+        embed_and_upsert(to_upsert, embeddings, pc_index, namespace, config)
+        for doc in to_upsert:
+            synced_hashes[doc_id(doc)] = doc_hash(doc)
+
+    if to_delete:
+        delete_ids(pc_index, to_delete, namespace)
+        for id in to_delete:
+            synced_hashes.pop(id, None)
+
+    # Lets the chat model drop cached answers built on the old catalog
+    write_catalog_version(catalog_version(synced_hashes))
+    print(f"Embedding cache hits: {embeddings.hits}, misses: {embeddings.misses}")
 
     print("Successfully uploaded docs to Pinecone vector store")
 
 
 @task
-def publish_dataset_to_weave(docs):
+def export_local_vector_store(docs, config, embeddings=None, count_tokens=None):
+    """
+    Writes the embeddings of every doc to the local vector store. Films
+    already embedded for Pinecone are served from the embedding cache, so
+    only films new since the last run hit the API.
+    """
+    if embeddings is None:
+        embeddings = CachedEmbeddings(
+            OpenAIEmbeddings(model=config['EMBEDDING_MODEL_NAME']),
+            EmbeddingCache(config['embedding_cache_dir'],
+                           config['EMBEDDING_MODEL_NAME'],
+                           max_entries=config['embedding_cache_max_entries']))
+    if count_tokens is None:
+        encoding = tiktoken.encoding_for_model(config['EMBEDDING_MODEL_NAME'])
+
+        def count_tokens(text):
+            return len(encoding.encode(text))
+
+    batches = batch_by_tokens(docs, config['embedding_batch_tokens'],
+                              config['embedding_batch_size'], count_tokens)
+    with ThreadPoolExecutor(config['embedding_concurrency']) as pool:
+        vectors = [vector for batch in pool.map(
+            lambda batch: embeddings.embed_documents([doc.page_content for doc in batch]),
+            batches) for vector in batch]
+
+    LocalVectorStore.save(vectors, docs, config['local_store_dir'])
+    if config['vector_store'] == 'local':
+        write_catalog_version(catalog_version({doc_id(doc): doc_hash(doc) for doc in docs}))
+    if isinstance(embeddings, CachedEmbeddings):
+        print(f"Embedding cache hits: {embeddings.hits}, misses: {embeddings.misses}")
+
+    print(f"Successfully exported {len(docs)} docs to the local vector store")
+
+
+@task
+def build_bm25_index(docs, config):
+    index = BM25Index(docs)
+    index.save(config['bm25_index_path'])
+    print(f"Successfully built the BM25 index over {len(docs)} docs "
+          f"({len(index.postings)} terms)")
+
+
+@task
+def publish_dataset_to_weave(catalog_path):
     # Initialize Weave
     weave.init('film-search')
 
+    table = read_catalog(catalog_path, columns=WEAVE_FIELDS)
     rows = []
-    for doc in docs:
+    for record in iter_catalog_records(table):
         row = {
-            'Title': doc.metadata.get('Title'),
-            'Runtime (minutes)': doc.metadata.get('Runtime (minutes)'),
-            'Language': doc.metadata.get('Language'),
-            'Overview': doc.page_content.split('. Keywords: ')[0].split('Overview: ')[-1],
-            'Release Year': str(doc.metadata.get('Release Year')),
-            'Genre': doc.metadata.get('Genre'),
-            'Keywords': doc.page_content.split('. Keywords: ')[-1],
-            'Actors': doc.metadata.get('Actors'),
-            'Directors': doc.metadata.get('Directors'),
-            'Stream': doc.metadata.get('Stream'),
-            'Buy': doc.metadata.get('Buy'),
-            'Rent': doc.metadata.get('Rent'),
-            'Production Companies': doc.metadata.get('Production Companies'),
-            'Rating': doc.metadata.get('Rating')
+            'Title': record['Title'],
+            'Runtime (minutes)': record['Runtime (minutes)'],
+            'Language': record['Language'],
+            'Overview': record['Overview'],
+            'Release Year': str(record['Release Year']),
+            'Genre': record['Genre'],
+            'Keywords': ', '.join(record['Keywords']),
+            'Actors': record['Actors'],
+            'Directors': record['Directors'],
+            'Stream': record['Stream'],
+            'Buy': record['Buy'],
+            'Rent': record['Rent'],
+            'Production Companies': record['Production Companies'],
+            'Rating': record['Rating']
         }
         rows.append(row)
 
@@ -250,10 +332,15 @@ def pinecone_flow():
         config = json.load(f)
 
     start()
-    pull_data_to_csv(config)
-    docs = convert_csv_to_docs()
-    upload_docs_to_pinecone(docs, config)
-    publish_dataset_to_weave(docs)
+    catalog_path = update_catalog(config)
+    docs = convert_catalog_to_docs(catalog_path)
+    if config["vector_store"] == "pinecone":
+        upload_docs_to_pinecone(docs, config)
+    if config["vector_store"] == "local" or config["export_local_store"]:
+        export_local_vector_store(docs, config)
+    if config["hybrid_search"]:
+        build_bm25_index(docs, config)
+    publish_dataset_to_weave(catalog_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """
+    Lower-cases {query}, collapses whitespace and drops trailing
+    punctuation, so trivially different spellings share a cache entry.
+    """
+    return re.sub(r'\s+', ' ', query).strip().rstrip('.!?').strip().lower()
+
+
+def replay_stream(text):
+    """
+    Splits a cached answer into word-sized chunks, so a replayed answer
+    streams into the UI like a fresh one.
+    """
+    yield from re.findall(r'\s*\S+\s*', text)
+
+
+class SemanticQueryCache:
+    """
+    In-process cache of query results. A lookup first tries an exact match
+    on the normalized query, then the most similar cached query by cosine
+    similarity of their embeddings. Entries expire after {ttl_seconds}, the
+    least recently used entry is dropped past {max_entries}, and everything
+    is dropped when the catalog version changes.
+
+    parameters:
+    embeddings (Embeddings): Model used for similarity lookups, or None for
+    exact matches only
+    similarity_threshold (float): Minimum cosine similarity of a hit
+    ttl_seconds (float): Lifetime of an entry
+    max_entries (int): Maximum number of cached queries
+    version_fn (callable): Returns the current catalog version
+    """
+
+    def __init__(self, embeddings=None, similarity_threshold=0.95,
+                 ttl_seconds=3600, max_entries=512, version_fn=None):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = version_fn() if version_fn else None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _embed(self, key):
+        vector = np.asarray(self.embeddings.embed_query(key), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, query):
+        """
+        Cached payload for {query}, or None on a miss.
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            for cached_key in [k for k, entry in self._entries.items()
+                               if now - entry['created_at'] > self.ttl_seconds]:
+                del self._entries[cached_key]
+            if key in self._entries:
+                return self._hit(key)
+            if self.embeddings is None or not self._entries:
+                self.misses += 1
+                return None
+
+        # Embed outside the lock so a slow embedding call does not block
+        # other lookups
+        vector = self._embed(key)
+        with self._lock:
+            keys = [k for k, entry in self._entries.items()
+                    if entry['vector'] is not None]
+            if keys:
+                matrix = np.stack([self._entries[k]['vector'] for k in keys])
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    return self._hit(keys[best])
+            self.misses += 1
+            return None
+
+    def _hit(self, key):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]['payload']
+
+    def put(self, query, payload):
+        key = normalize_query(query)
+        vector = self._embed(key) if self.embeddings is not None else None
+        with self._lock:
+            self._check_version()
+            self._entries[key] = {'payload': payload, 'vector': vector,
+                                  'created_at': time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PersistentLRUCache:
+    """
+    LRU cache of JSON values, keyed by string, that persists to one JSON
+    file. The file is tied to a {fingerprint} of whatever produced the
+    values, and is started over when it changes. Nothing is written until
+    save(), so callers storing many values write the file once.
+
+    parameters:
+    path (str): JSON file the cache persists to, or None to keep it in memory
+    fingerprint (str): Identifies what produced the entries
+    max_entries (int): Maximum number of cached values
+    """
+
+    def __init__(self, path=None, fingerprint=None, max_entries=4096):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('fingerprint') == fingerprint:
+                self._entries.update(saved['entries'])
+
+    def _key(self, key):
+        return key
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._key(key) in self._entries
+
+    def get(self, key):
+        """
+        Cached value for {key}, or None on a miss.
+        """
+        key = self._key(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            key = self._key(key)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'fingerprint': self.fingerprint,
+                           'entries': self._entries}, f)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class StructuredQueryCache(PersistentLRUCache):
+    """
+    Persistent LRU cache of query constructor output, keyed by normalized
+    query. It stores the raw LLM text rather than the parsed StructuredQuery
+    so entries stay plain JSON; parsing is cheap next to the LLM call. The
+    file is tied to a {fingerprint} of the model and prompt, and is started
+    over when either changes. Every put is saved, as queries arrive one at
+    a time.
+
+    parameters:
+    path (str): JSON file the cache persists to, or None to keep it in memory
+    fingerprint (str): Identifies the model and prompt that produced entries
+    max_entries (int): Maximum number of cached queries
+    """
+
+    def _key(self, query):
+        return normalize_query(query)
+
+    def put(self, query, text):
+        super().put(query, text)
+        self.save()
@@ -0,0 +1,55 @@
+from langchain_core.documents import Document
+
+from utils import CSVBatchWriter, record_to_row
+
+CSV_HEADER = ['Title', 'Runtime (minutes)', 'Language', 'Overview',
+              'Release Year', 'Genre', 'Keywords',
+              'Actors', 'Directors', 'Stream', 'Buy', 'Rent',
+              'Production Companies', 'Rating', 'TMDB ID']
+
+# Record fields stored as document metadata, and so filterable by the
+# self-query retriever
+METADATA_FIELDS = ['Title', 'Runtime (minutes)', 'Language', 'Release Year',
+                   'Genre', 'Actors', 'Directors', 'Stream', 'Buy', 'Rent',
+                   'Production Companies', 'Rating', 'TMDB ID']
+
+# Catalog columns needed to build a Document
+DOCUMENT_FIELDS = METADATA_FIELDS + ['Overview', 'Keywords']
+
+
+def page_content(record):
+    """
+    Text that gets embedded for a film: its title, overview and keywords.
+    """
+    keywords = ', '.join(record['Keywords']) or 'None'
+    return ('Title: ' + record['Title'] +
+            '. Overview: ' + record['Overview'] +
+            ' Keywords: ' + keywords)
+
+
+def record_to_document(record):
+    """
+    Turns a movie record into a Document. Missing values are left out of
+    the metadata since Pinecone cannot store nulls.
+    """
+    metadata = {field: record[field] for field in METADATA_FIELDS
+                if record.get(field) is not None}
+    return Document(page_content=page_content(record), metadata=metadata)
+
+
+def iter_documents(records):
+    """
+    Lazily converts {records} into Documents, one film at a time.
+    """
+    for record in records:
+        yield record_to_document(record)
+
+
+def export_csv(filename, records):
+    """
+    Writes {records} to a csv file with the yearly csv column layout. The
+    file is replaced atomically once all rows are written.
+    """
+    with CSVBatchWriter(filename, CSV_HEADER) as writer:
+        for record in records:
+            writer.write_row(record_to_row(record) + [record['TMDB ID']])
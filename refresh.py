@@ -0,0 +1,185 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+
+from utils import discover_ids, fetch_details, get_changed_ids, movie_record
+
+MANIFEST_PATH = './data/manifest.json'
+MANIFEST_VERSION = 3
+DAY_SECONDS = 24 * 60 * 60
+
+
+def empty_manifest():
+    return {'version': MANIFEST_VERSION, 'last_refresh': None,
+            'years': {}, 'movies': {}}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Loads the refresh manifest, which records for every year the ids that
+    were discovered and for every movie its content hash and the time it
+    was last fetched. The records themselves live in the catalog.
+
+    parameters:
+    path (str): Location of the manifest
+
+    returns:
+    dict: The manifest, or an empty one if none has been written yet or it
+    was written in an older format
+    """
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """
+    Writes the manifest through a temp file so a crash never leaves a
+    truncated manifest behind.
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def record_hash(record):
+    return hashlib.sha1(
+        json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def is_stale(fetched_at, year, latest_year, policy, now):
+    """
+    Whether data fetched at {fetched_at} for a film from {year} is due for a
+    refresh. Recent years change often (new ratings, new streaming deals) so
+    they get a shorter max age than the back catalog.
+
+    parameters:
+    fetched_at (float or None): Unix time of the last fetch
+    year (int): Release year of the film
+    latest_year (int): Most recent year in the catalog
+    policy (dict): 'recent_years', 'recent_max_age_days' and 'max_age_days'
+    now (float): Current unix time
+
+    returns:
+    bool: True if the data should be fetched again
+    """
+    if fetched_at is None:
+        return True
+    if latest_year - year < policy['recent_years']:
+        max_age_days = policy['recent_max_age_days']
+    else:
+        max_age_days = policy['max_age_days']
+    return now - fetched_at >= max_age_days * DAY_SECONDS
+
+
+def incremental_refresh(client, years, manifest, records, policy,
+                        max_workers=8, now=None):
+    """
+    Brings {manifest} up to date while only fetching what may have changed:
+    years whose discover results are stale, films that are new to the
+    catalog, films listed in TMDB's change feed since the last refresh, and
+    films whose data is older than the staleness policy allows.
+
+    parameters:
+    client (TMDBClient): Client to send the requests with
+    years (iterable of int): Years of interest
+    manifest (dict): Manifest from load_manifest, updated in place
+    records (dict): Movie id to record from the previous catalog, updated
+    in place
+    policy (dict): Staleness policy, see is_stale
+    max_workers (int): Maximum number of requests in flight
+    now (float): Current unix time, defaults to time.time()
+
+    returns:
+    set of int: Years whose records changed
+    """
+    now = now or time.time()
+    years = list(years)
+    latest_year = max(years)
+    dirty = set()
+
+    # Re-discover the ids of stale years
+    stale_years = [
+        year for year in years
+        if is_stale(manifest['years'].get(str(year), {}).get('discovered_at'),
+                    year, latest_year, policy, now)
+    ]
+    for year, ids in discover_ids(client, stale_years, max_workers).items():
+        # Keep the year's last known ids and try again on the next refresh
+        if ids is None:
+            print(f"Could not discover the films of {year}, keeping its last ids")
+            continue
+        entry = manifest['years'].get(str(year))
+        if entry is None or entry['ids'] != ids:
+            dirty.add(year)
+        manifest['years'][str(year)] = {'ids': ids, 'discovered_at': now}
+
+    # Films TMDB reports as changed since the last refresh. If the change
+    # feed fails, only the staleness policy applies this time and the same
+    # window is asked for again on the next refresh
+    changed = set()
+    last_refresh = now
+    if manifest['last_refresh'] is not None:
+        changed = get_changed_ids(
+            client,
+            datetime.date.fromtimestamp(manifest['last_refresh']),
+            datetime.date.fromtimestamp(now))
+        if changed is None:
+            print("Could not fetch the TMDB change feed, keeping the last refresh time")
+            changed = set()
+            last_refresh = manifest['last_refresh']
+
+    movie_years = {}
+    for year in years:
+        for movie_id in manifest['years'].get(str(year), {}).get('ids', []):
+            movie_years[movie_id] = year
+
+    to_fetch = [
+        movie_id for movie_id, year in movie_years.items()
+        if movie_id not in manifest['movies'] or movie_id not in records
+        or movie_id in changed
+        or is_stale(manifest['movies'][movie_id]['fetched_at'], year,
+                    latest_year, policy, now)
+    ]
+    print(f"Refreshing {len(to_fetch)} of {len(movie_years)} films "
+          f"({len(changed)} changed on TMDB)")
+
+    for movie_id, details in fetch_details(client, to_fetch, max_workers):
+        record = movie_record(details)
+        content_hash = record_hash(record)
+        year = movie_years[movie_id]
+        movie = manifest['movies'].get(movie_id)
+        if movie is None or movie['hash'] != content_hash:
+            dirty.add(year)
+        manifest['movies'][movie_id] = {'year': year, 'hash': content_hash,
+                                        'fetched_at': now}
+        records[movie_id] = record
+
+    # Forget films and years that dropped out of the catalog
+    manifest['years'] = {str(year): manifest['years'][str(year)]
+                         for year in years if str(year) in manifest['years']}
+    manifest['movies'] = {movie_id: movie
+                          for movie_id, movie in manifest['movies'].items()
+                          if movie_id in movie_years}
+    for movie_id in set(records) - movie_years.keys():
+        del records[movie_id]
+    manifest['last_refresh'] = last_refresh
+
+    return dirty
+
+
+def iter_year_records(manifest, records, year):
+    """
+    Records of every film from {year}, most popular first. A year that was
+    never discovered has none.
+    """
+    for movie_id in manifest['years'].get(str(year), {}).get('ids', []):
+        if movie_id in records:
+            yield records[movie_id]
@@ -5,8 +5,9 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain.chains.query_constructor.base import AttributeInfo, StructuredQuery
 from langchain_community.query_constructors.pinecone import PineconeTranslator
 from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_core.runnables import RunnableParallel, RunnablePassthrough, RunnableSerializable
+from langchain_core.runnables import Runnable, RunnableLambda, RunnableParallel, RunnablePassthrough, RunnableSerializable
 from langchain_pinecone import PineconeVectorStore
+from langchain_core.vectorstores import VectorStore
 from langchain_openai import OpenAIEmbeddings
 from langchain.chains.query_constructor.base import (
     StructuredQueryOutputParser,
@@ -16,16 +17,39 @@ from langchain.chains.query_constructor.base import (
 # Pinecone
 from pinecone import Pinecone
 
+# Caching
+from embedding_cache import QueryEmbeddings
+from local_vector_store import LocalVectorStore
+from bm25_index import BM25Index, reciprocal_rank_fusion
+
+# Context
+from context_builder import build_context
+import tiktoken
+from query_cache import SemanticQueryCache, StructuredQueryCache, replay_stream
+from vector_sync import read_catalog_version
+
 # General
+import asyncio
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
-from typing import Optional
+import time
+from typing import Callable, Optional
 from typing import Dict
 
 # Weave
 import weave
 from weave import Model
+from tracing import trace_request
+
+# Metrics
+from metrics import LatencyMetrics, pipeline_metrics
+
+# Answer given without calling the summary model when retrieval finds nothing
+NO_MATCH_ANSWER = ("I couldn't find any films that match your query. "
+                   "Try loosening some of its requirements.")
 
 
 class rosebud_chat_model(Model):
@@ -33,26 +57,48 @@ class rosebud_chat_model(Model):
     SUMMARY_MODEL_NAME: str = None
     EMBEDDING_MODEL_NAME: str = None
     constructor_prompt: Optional[ChatPromptTemplate] = None
-    vectorstore: Optional[PineconeVectorStore] = None
+    vectorstore: Optional[VectorStore] = None
     retriever: Optional[SelfQueryRetriever] = None
-    rag_chain_with_source: Optional[RunnableParallel] = None
-    query_constructor: RunnableSerializable[Dict, StructuredQuery] = None
-    context: str = None
+    rag_chain_with_source: Optional[RunnableSerializable] = None
+    rag_chain_from_query: Optional[RunnableSerializable] = None
+    answer_chain: Optional[RunnableSerializable] = None
+    query_cache: Optional[SemanticQueryCache] = None
+    query_cache_level: str = None
+    query_constructor: Runnable[Dict, StructuredQuery] = None
+    query_constructor_llm: Optional[RunnableSerializable] = None
+    query_constructor_parser: Optional[StructuredQueryOutputParser] = None
+    structured_query_cache: Optional[StructuredQueryCache] = None
+    bm25_index: Optional[BM25Index] = None
+    rrf_k: int = None
+    context_token_budget: int = None
+    count_tokens: Optional[Callable[[str], int]] = None
     top_k: int = None
-
-    def __init__(self, **kwargs):
+    latency_metrics: Optional[LatencyMetrics] = None
+
+    def __init__(self, config: Optional[Dict] = None, retriever_llm=None, summary_llm=None,
+                 embeddings=None, **kwargs):
+        """
+        Builds the model from config.json. The config, the two chat models
+        and the embeddings can be passed in instead, e.g. local stand-ins
+        for the benchmark.
+        """
         super().__init__(**kwargs)
+        if self.latency_metrics is None:
+            self.latency_metrics = pipeline_metrics
         load_dotenv()
-        with open('./config.json') as f:
-            config = json.load(f)
-            self.RETRIEVER_MODEL_NAME = config["RETRIEVER_MODEL_NAME"]
-            self.SUMMARY_MODEL_NAME = config["SUMMARY_MODEL_NAME"]
-            self.EMBEDDING_MODEL_NAME = config["EMBEDDING_MODEL_NAME"]
-            self.top_k = config["top_k"]
+        if config is None:
+            with open('./config.json') as f:
+                config = json.load(f)
+        self.RETRIEVER_MODEL_NAME = config["RETRIEVER_MODEL_NAME"]
+        self.SUMMARY_MODEL_NAME = config["SUMMARY_MODEL_NAME"]
+        self.EMBEDDING_MODEL_NAME = config["EMBEDDING_MODEL_NAME"]
+        self.top_k = config["top_k"]
         self.initialize_query_constructor()
-        self.initialize_vector_store()
-        self.initialize_retriever()
-        self.initialize_chat_model(config)
+        self.initialize_vector_store(config, embeddings)
+        self.initialize_retriever(config, retriever_llm)
+        self.initialize_keyword_index(config)
+        self.initialize_chat_model(config, summary_llm)
+        self.initialize_query_cache(config)
 
     def initialize_query_constructor(self):
         document_content_description = "Brief overview of a movie, along with keywords"
@@ -162,7 +208,19 @@ class rosebud_chat_model(Model):
             examples=examples,
         )
 
-    def initialize_vector_store(self):
+    def initialize_vector_store(self, config, embeddings=None):
+        if embeddings is None:
+            # The flow's on-disk embedding cache is left to the flow
+            embeddings = QueryEmbeddings(
+                OpenAIEmbeddings(model=self.EMBEDDING_MODEL_NAME),
+                max_entries=config['query_embedding_cache_max_entries'])
+
+        # The local store is exported by the Pinecone flow and searched
+        # in-process, with no network hop per query
+        if config['vector_store'] == 'local':
+            self.vectorstore = LocalVectorStore.load(embeddings, config['local_store_dir'])
+            return
+
         # Create empty index
         PINECONE_KEY, PINECONE_INDEX_NAME = os.getenv(
             'PINECONE_API_KEY'), os.getenv('PINECONE_INDEX_NAME')
@@ -172,8 +230,6 @@ class rosebud_chat_model(Model):
         # Target index and check status
         pc_index = pc.Index(PINECONE_INDEX_NAME)
 
-        embeddings = OpenAIEmbeddings(model=self.EMBEDDING_MODEL_NAME)
-
         namespace = "film_search_prod"
         self.vectorstore = PineconeVectorStore(
             index=pc_index,
@@ -181,15 +237,27 @@ class rosebud_chat_model(Model):
             namespace=namespace
         )
 
-    def initialize_retriever(self):
-        query_model = ChatOpenAI(
-            model=self.RETRIEVER_MODEL_NAME,
-            temperature=0,
-            streaming=True,
+    def initialize_retriever(self, config, query_model=None):
+        if query_model is None:
+            query_model = ChatOpenAI(
+                model=self.RETRIEVER_MODEL_NAME,
+                temperature=0,
+                streaming=True,
+            )
+
+        # The constructor runs at temperature 0, so its output for a query is
+        # cached and reused across requests and restarts
+        self.query_constructor_llm = self.constructor_prompt | query_model | StrOutputParser()
+        self.query_constructor_parser = StructuredQueryOutputParser.from_components()
+        fingerprint = hashlib.sha1(
+            (self.RETRIEVER_MODEL_NAME + self.constructor_prompt.format(query='')).encode('utf-8')
+        ).hexdigest()
+        self.structured_query_cache = StructuredQueryCache(
+            path=config['query_constructor_cache_path'],
+            fingerprint=fingerprint,
+            max_entries=config['query_constructor_cache_max_entries'],
         )
-
-        output_parser = StructuredQueryOutputParser.from_components()
-        self.query_constructor = self.constructor_prompt | query_model | output_parser
+        self.query_constructor = RunnableLambda(self.construct_query, afunc=self.aconstruct_query)
 
         self.retriever = SelfQueryRetriever(
             query_constructor=self.query_constructor,
@@ -198,16 +266,76 @@ class rosebud_chat_model(Model):
             search_kwargs={'k': self.top_k}
         )
 
-    def initialize_chat_model(self, config):
-        def format_docs(docs):
-            return "\n\n".join(f"{doc.page_content}\n\nMetadata: {doc.metadata}" for doc in docs)
-
-        chat_model = ChatOpenAI(
-            model=self.SUMMARY_MODEL_NAME,
-            temperature=config['TEMPERATURE'],
-            streaming=True,
-            max_retries=10
-        )
+    def initialize_keyword_index(self, config):
+        # Keyword hits are fused with vector hits when the flow has built
+        # the BM25 index
+        if config['hybrid_search']:
+            self.bm25_index = BM25Index.load(config['bm25_index_path'])
+            self.rrf_k = config['rrf_k']
+
+    def construct_query(self, inputs):
+        """
+        Structured query for a question, from the structured query cache if
+        the question was seen before. Output is only cached once it parses.
+        """
+        query = inputs['query'] if isinstance(inputs, dict) else inputs
+        with self.latency_metrics.span('query_constructor'):
+            text = self.structured_query_cache.get(query)
+            if text is not None:
+                return self.query_constructor_parser.parse(text)
+
+            text = self.query_constructor_llm.invoke({'query': query})
+            structured_query = self.query_constructor_parser.parse(text)
+        self.structured_query_cache.put(query, text)
+        return structured_query
+
+    async def aconstruct_query(self, inputs):
+        query = inputs['query'] if isinstance(inputs, dict) else inputs
+        with self.latency_metrics.span('query_constructor'):
+            text = self.structured_query_cache.get(query)
+            if text is not None:
+                return self.query_constructor_parser.parse(text)
+
+            text = await self.query_constructor_llm.ainvoke({'query': query})
+            structured_query = self.query_constructor_parser.parse(text)
+        # The cache rewrites its file on put, which must not block the event loop
+        await asyncio.to_thread(self.structured_query_cache.put, query, text)
+        return structured_query
+
+    def warm_query_cache(self, queries, max_workers=4):
+        """
+        Runs the query constructor for every query in {queries} that is not
+        cached yet, e.g. queries from the logged history.
+
+        returns:
+        int: Number of queries added to the cache
+        """
+        pending = list(dict.fromkeys(
+            query for query in queries if query not in self.structured_query_cache))
+
+        def warm(query):
+            try:
+                self.construct_query(query)
+                return True
+            except Exception:
+                return False
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(executor.map(warm, pending))
+
+    def initialize_chat_model(self, config, chat_model=None):
+        if self.count_tokens is None:
+            encoding = tiktoken.encoding_for_model(self.SUMMARY_MODEL_NAME)
+            self.count_tokens = lambda text: len(encoding.encode(text))
+        self.context_token_budget = config['context_token_budget']
+
+        if chat_model is None:
+            chat_model = ChatOpenAI(
+                model=self.SUMMARY_MODEL_NAME,
+                temperature=config['TEMPERATURE'],
+                streaming=True,
+                max_retries=10
+            )
 
         prompt = ChatPromptTemplate.from_messages(
             [
@@ -243,40 +371,220 @@ class rosebud_chat_model(Model):
 
         # Create a chatbot Question & Answer chain from the retriever
         rag_chain_from_docs = (
-            RunnablePassthrough.assign(
-                context=(lambda x: format_docs(x["context"]))) | prompt | chat_model | StrOutputParser()
+            (lambda x: {"question": x["question"], "context": x["rendered_context"]})
+            | prompt | chat_model | StrOutputParser()
         )
 
+        # The structured query is built once and shared by the vector search
+        # and the "query_constructor" output, rather than running the
+        # constructor LLM a second time inside the retriever. The chain is
+        # kept in stages so a query cache hit can resume from any of them.
+        # When the filter matched no films the summary model is skipped, since
+        # all it could say is that nothing was found. The films are rendered
+        # once, as "rendered_context", for both the prompt and the caller
+        def answer(inputs):
+            if not inputs["rendered_context"]:
+                return NO_MATCH_ANSWER
+            return rag_chain_from_docs
+
+        self.answer_chain = RunnablePassthrough.assign(
+            rendered_context=lambda x: self.format_context(x["context"])
+        ) | RunnablePassthrough.assign(answer=RunnableLambda(answer))
+        self.rag_chain_from_query = RunnablePassthrough.assign(
+            context=RunnableLambda(self.retrieve, afunc=self.aretrieve)
+        ) | self.answer_chain
         self.rag_chain_with_source = RunnableParallel(
-            {"context": self.retriever, "question": RunnablePassthrough(), "query_constructor": self.query_constructor}
-        ).assign(answer=rag_chain_from_docs)
+            {"question": RunnablePassthrough(), "query_constructor": self.query_constructor}
+        ) | self.rag_chain_from_query
+
+    def initialize_query_cache(self, config):
+        """
+        Caches results of recent queries, at the stage set by
+        "query_cache_level": "answer" replays the whole answer, "retrieval"
+        reuses the retrieved films and "query" reuses the structured query.
+        """
+        if not config['query_cache_enabled']:
+            return
+
+        self.query_cache_level = config['query_cache_level']
+        self.query_cache = SemanticQueryCache(
+            embeddings=self.vectorstore.embeddings,
+            similarity_threshold=config['query_cache_similarity_threshold'],
+            ttl_seconds=config['query_cache_ttl_seconds'],
+            max_entries=config['query_cache_max_entries'],
+            version_fn=read_catalog_version,
+        )
+
+    def format_context(self, docs):
+        """
+        The retrieved films as the summary model sees them: compact, with
+        repeats dropped and cut to the context token budget.
+        """
+        with self.latency_metrics.span('format_context'):
+            return build_context(docs, self.context_token_budget, self.count_tokens)
+
+    def retrieve(self, inputs: Dict):
+        """
+        Runs the vector search for an already constructed structured query,
+        the same way the self-query retriever would. With hybrid search on,
+        BM25 hits under the same filter are fused in with reciprocal rank
+        fusion.
+        """
+        with self.latency_metrics.span('retrieval'):
+            new_query, search_kwargs = self.retriever._prepare_query(
+                inputs["question"], inputs["query_constructor"])
+            docs = self.retriever._get_docs_with_query(new_query, search_kwargs)
+            if self.bm25_index is None:
+                return docs
+
+            keyword_docs = self.bm25_index.search(
+                new_query, k=self.top_k, filter=search_kwargs.get('filter'))
+            return reciprocal_rank_fusion([docs, keyword_docs], self.top_k, k=self.rrf_k)
+
+    def _resume(self, query: str, cached: Optional[Dict]):
+        """
+        Chain and inputs that answer {query}, resuming from the stage of a
+        query cache hit set by "query_cache_level".
+        """
+        if cached is None:
+            return self.rag_chain_with_source, query
+        if self.query_cache_level == 'retrieval':
+            return self.answer_chain, {
+                'question': query, 'query_constructor': cached['query_constructor'],
+                'context': cached['docs']}
+        return self.rag_chain_from_query, {
+            'question': query, 'query_constructor': cached['query_constructor']}
+
+    def _collect(self, chunk: Dict, result: Dict, state: Dict):
+        """
+        Folds a streamed chain chunk into {result}, which is what gets
+        cached, and into the caller's {state}.
+        """
+        if 'answer' in chunk:
+            result['answer'] += chunk['answer']
+        if 'context' in chunk:
+            result['docs'] = chunk['context']
+        if 'rendered_context' in chunk:
+            result['context'] = chunk['rendered_context']
+            state['context'] = result['context']
+        if 'query_constructor' in chunk:
+            result['query_constructor'] = chunk['query_constructor']
+            state['query_constructor'] = chunk['query_constructor'].json()
+
+    def _record_answer(self, start: float, first_token: Optional[float], answer: str):
+        """
+        Records how long a streamed answer that began at {start} took to
+        finish, and how fast the summary model generated it once its first
+        token arrived at {first_token}.
+        """
+        end = time.perf_counter()
+        self.latency_metrics.record('last_token', end - start)
+        if first_token is not None and end > first_token and answer != NO_MATCH_ANSWER:
+            self.latency_metrics.record('tokens_per_second',
+                                        self.count_tokens(answer) / (end - first_token))
+
+    async def aretrieve(self, inputs: Dict):
+        with self.latency_metrics.span('retrieval'):
+            new_query, search_kwargs = self.retriever._prepare_query(
+                inputs["question"], inputs["query_constructor"])
+            docs = await self.retriever._aget_docs_with_query(new_query, search_kwargs)
+            if self.bm25_index is None:
+                return docs
+
+            keyword_docs = self.bm25_index.search(
+                new_query, k=self.top_k, filter=search_kwargs.get('filter'))
+            return reciprocal_rank_fusion([docs, keyword_docs], self.top_k, k=self.rrf_k)
 
     # @weave.op()
-    def predict_stream(self, query: str):
-        weave.init('film-search')
-
-        try:
-            for chunk in self.rag_chain_with_source.stream(query):
-                if 'answer' in chunk:
-                    yield chunk['answer']
-                elif 'context' in chunk:
-                    docs = chunk['context']
-                    self.context = "\n\n".join(f"{doc.page_content}\n\nMetadata: {doc.metadata}" for doc in docs)
-                elif 'query_constructor' in chunk:
-                    self.query_constructor = chunk['query_constructor'].json()
-
-        except Exception as e:
-            return {'answer': f"An error occurred: {e}"}
+    def predict_stream(self, query: str, state: Optional[Dict] = None):
+        """
+        Streams the answer to {query}. The model is shared between requests,
+        so the retrieved context and the structured query are written to the
+        caller's {state} dict instead of to the model. Queries close enough to
+        a cached one resume from the cached stage instead of starting over.
+        """
+        with trace_request():
+            if state is None:
+                state = {}
+
+            cached = self.query_cache.get(query) if self.query_cache is not None else None
+            if cached is not None and self.query_cache_level == 'answer':
+                state['context'] = cached['context']
+                state['query_constructor'] = cached['query_constructor'].json()
+                yield from replay_stream(cached['answer'])
+                return
+
+            chain, inputs = self._resume(query, cached)
+            result = {'answer': ''}
+            start, first_token = time.perf_counter(), None
+            try:
+                for chunk in chain.stream(inputs):
+                    self._collect(chunk, result, state)
+                    if 'answer' in chunk:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            self.latency_metrics.record('first_token', first_token - start)
+                        yield chunk['answer']
+
+            except Exception as e:
+                return {'answer': f"An error occurred: {e}"}
+            self._record_answer(start, first_token, result['answer'])
+
+            if cached is None and self.query_cache is not None and result['answer']:
+                self.query_cache.put(query, result)
+
+    async def apredict_stream(self, query: str, state: Optional[Dict] = None):
+        """
+        Async version of predict_stream, built on the chain's astream so
+        many queries can be in flight on one event loop.
+        """
+        with trace_request():
+            if state is None:
+                state = {}
+
+            # Cache lookups may embed the query, so they run off the event loop
+            cached = None
+            if self.query_cache is not None:
+                cached = await asyncio.to_thread(self.query_cache.get, query)
+            if cached is not None and self.query_cache_level == 'answer':
+                state['context'] = cached['context']
+                state['query_constructor'] = cached['query_constructor'].json()
+                for chunk in replay_stream(cached['answer']):
+                    yield chunk
+                return
+
+            chain, inputs = self._resume(query, cached)
+            result = {'answer': ''}
+            start, first_token = time.perf_counter(), None
+            try:
+                async for chunk in chain.astream(inputs):
+                    self._collect(chunk, result, state)
+                    if 'answer' in chunk:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            self.latency_metrics.record('first_token', first_token - start)
+                        yield chunk['answer']
+
+            except Exception as e:
+                yield f"An error occurred: {e}"
+                return
+            self._record_answer(start, first_token, result['answer'])
+
+            if cached is None and self.query_cache is not None and result['answer']:
+                await asyncio.to_thread(self.query_cache.put, query, result)
+
+    async def apredict(self, query: str):
+        with trace_request():
+            try:
+                with self.latency_metrics.span('last_token'):
+                    result = await self.rag_chain_with_source.ainvoke(query)
+                return {
+                    'answer': result['answer'],
+                    'context': result['rendered_context']
+                }
+            except Exception as e:
+                return {'answer': f"An error occurred: {e}", 'context': ""}
 
     @weave.op()
     async def predict(self, query: str):
-        weave.init('film-search')
-
-        try:
-            result = self.rag_chain_with_source.invoke(query)
-            return {
-                'answer': result['answer'],
-                'context': "\n".join(f"{doc.page_content}\n\nMetadata: {doc.metadata}" for doc in result['context'])
-            }
-        except Exception as e:
-            return {'answer': f"An error occurred: {e}", 'context': ""}
+        return await self.apredict(query)
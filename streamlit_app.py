@@ -1,10 +1,10 @@
 import base64
 import streamlit as st
 from rosebud_chat_model import rosebud_chat_model
+from inference_service import recommend_stream
+from feedback_logger import FeedbackLogger
+from tracing import init_tracing
 import json
-import wandb
-import datetime
-import threading
 
 
 st.set_page_config(
@@ -43,44 +43,52 @@ if 'feedback_given' not in st.session_state:
     st.session_state.feedback_given = False
 
 
+@st.cache_resource
+def load_chat_model():
+    # Built once per server process and shared by every session, so clients
+    # and prompts are not rebuilt on the request path
+    init_tracing(config["tracing_project"], config["tracing_sample_rate"])
+    return rosebud_chat_model()
+
+
 def generate_response(query):
     with st.spinner(text="Generating awesome recommendations..."):
-        chat_model = rosebud_chat_model()
+        state = {}
+        # With an inference service configured, the model runs there and
+        # this app only renders the stream
+        if config["inference_service_url"]:
+            stream = recommend_stream(config["inference_service_url"], query, state)
+        else:
+            stream = load_chat_model().predict_stream(query, state)
         with st.chat_message("assistant"):
-            response = st.write_stream(chat_model.predict_stream(query))
+            response = st.write_stream(stream)
         st.session_state.query = query
-        st.session_state.query_constructor = chat_model.query_constructor
-        st.session_state.context = chat_model.context
+        st.session_state.query_constructor = state.get('query_constructor')
+        st.session_state.context = state.get('context', "")
         st.session_state.response = response
         st.session_state.sentiment = None
         st.session_state.feedback_given = False
 
 
+@st.cache_resource
+def load_feedback_logger():
+    # One queue and worker per server process, logging to a single W&B run
+    return FeedbackLogger(project="film-search",
+                          spill_path=config["feedback_spill_path"],
+                          batch_size=config["feedback_batch_size"],
+                          flush_seconds=config["feedback_flush_seconds"],
+                          max_queue=config["feedback_queue_size"])
+
+
 def start_log_feedback(feedback):
     print("Logging feedback.")
     st.session_state.feedback_given = True
     st.session_state.sentiment = feedback
-    thread = threading.Thread(target=log_feedback, args=(st.session_state.sentiment,
-                                                         st.session_state.query,
-                                                         st.session_state.query_constructor,
-                                                         st.session_state.context,
-                                                         st.session_state.response))
-    thread.start()
-
-
-def log_feedback(sentiment, query, query_constructor, context, response):
-    ct = datetime.datetime.now()
-    wandb.init(project="film-search",
-               name=f"query: {ct}")
-    table = wandb.Table(columns=["sentiment", "query", "query_constructor", "context", "response"])
-    table.add_data(sentiment,
-                   query,
-                   query_constructor,
-                   context,
-                   response
-                   )
-    wandb.log({"Query Log": table})
-    wandb.finish()
+    load_feedback_logger().log(st.session_state.sentiment,
+                               st.session_state.query,
+                               st.session_state.query_constructor,
+                               st.session_state.context,
+                               st.session_state.response)
 
 
 col1, col2, col3 = st.columns(3)
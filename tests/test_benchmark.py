@@ -0,0 +1,42 @@
+import copy
+
+from langchain.chains.query_constructor.base import StructuredQueryOutputParser
+
+from ..benchmark import (compare, fixture_catalog, load_baseline, run_benchmark,
+                         structured_query_response)
+
+
+def test_fixture_catalog_is_deterministic():
+    assert list(fixture_catalog(5)) == list(fixture_catalog(5))
+    assert list(fixture_catalog(5, seed=1)) != list(fixture_catalog(5))
+
+
+def test_fake_query_constructor_output_parses():
+    text = structured_query_response('...\nUser Query:\nfilms about dogs\n\nStructured Request:\n')
+    structured_query = StructuredQueryOutputParser.from_components().parse(text)
+    assert structured_query.query == 'films about dogs'
+
+
+def test_compare_flags_regressions():
+    baseline = load_baseline()
+    assert compare(baseline, baseline) == []
+
+    report = copy.deepcopy(baseline)
+    report['stages']['retrieval']['p50'] = baseline['stages']['retrieval']['p50'] * 2 + 0.1
+    report['throughput']['queries_per_second'] /= 3
+    del report['stages']['first_token']
+    report['stages']['tokens_per_second']['p50'] /= 3
+    regressions = compare(report, baseline)
+    assert [line.split(':')[0] for line in regressions] == \
+        ['retrieval', 'first_token', 'tokens_per_second', 'throughput']
+
+    # A faster token rate is not a regression
+    report = copy.deepcopy(baseline)
+    report['stages']['tokens_per_second']['p50'] *= 3
+    assert compare(report, baseline) == []
+
+
+def test_no_regression_against_baseline():
+    baseline = load_baseline()
+    report = run_benchmark(**baseline['settings'])
+    assert compare(report, baseline) == []
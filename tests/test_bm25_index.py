@@ -0,0 +1,44 @@
+from langchain_core.documents import Document
+from ..bm25_index import BM25Index, reciprocal_rank_fusion
+
+FILMS = [
+    ('1', 'Title: The Lobster. Overview: A dark comedy by Yorgos Lanthimos. Keywords: dystopia', 2015),
+    ('2', 'Title: Heat. Overview: A heist in Los Angeles. Keywords: heist, police', 1995),
+    ('3', 'Title: Poor Things. Overview: Yorgos Lanthimos adapts a novel. Keywords: surreal', 2023),
+    ('4', 'Title: Dogtooth. Overview: A family keeps its children at home. Keywords: isolation', 2009),
+]
+
+
+def make_docs():
+    return [Document(page_content=text, metadata={'TMDB ID': id, 'Release Year': year})
+            for id, text, year in FILMS]
+
+
+def ids(docs):
+    return [doc.metadata['TMDB ID'] for doc in docs]
+
+
+def test_search_ranks_keyword_matches():
+    index = BM25Index(make_docs())
+    assert set(ids(index.search('Yorgos Lanthimos', k=4))) == {'1', '3'}
+    assert ids(index.search('heist', k=4)) == ['2']
+    assert index.search('nothing matches this', k=4) == []
+
+
+def test_search_applies_filter():
+    index = BM25Index(make_docs())
+    docs = index.search('Yorgos Lanthimos', k=4, filter={'Release Year': {'$gt': 2020}})
+    assert ids(docs) == ['3']
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'bm25.json')
+    BM25Index(make_docs()).save(path)
+    assert ids(BM25Index.load(path).search('dogtooth')) == ['4']
+    assert BM25Index.load(str(tmp_path / 'missing.json')) is None
+
+
+def test_reciprocal_rank_fusion_dedupes_and_rewards_agreement():
+    docs = make_docs()
+    fused = reciprocal_rank_fusion([[docs[1], docs[0], docs[3]], [docs[0], docs[2]]], 3)
+    assert ids(fused) == ['1', '2', '3']
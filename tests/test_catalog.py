@@ -0,0 +1,20 @@
+from ..utils import movie_record
+from ..catalog import iter_catalog_records, read_catalog, write_catalog
+
+
+def test_catalog_round_trip_keeps_types(tmp_path, my_movie):
+    path = tmp_path / 'catalog.parquet'
+    record = movie_record(dict(my_movie, vote_average=7.2))
+    assert write_catalog([record], path) == 1
+
+    assert list(iter_catalog_records(read_catalog(path))) == [record]
+
+    table = read_catalog(path, columns=['Title', 'Genre'])
+    assert table.column_names == ['Title', 'Genre']
+    assert table.column('Genre').to_pylist() == [['Drama']]
+
+
+def test_missing_catalog_is_empty(tmp_path):
+    table = read_catalog(tmp_path / 'missing.parquet', columns=['Title'])
+    assert table.num_rows == 0
+    assert table.column_names == ['Title']
@@ -0,0 +1,50 @@
+from langchain_core.documents import Document
+from ..context_builder import build_context, overview, render_doc
+
+
+def make_doc(id, title, stream=None):
+    metadata = {'TMDB ID': id, 'Title': title, 'Runtime (minutes)': 120,
+                'Release Year': 2001, 'Buy': ['Apple TV'] * 20,
+                'Production Companies': ['Studio'] * 20}
+    if stream is not None:
+        metadata['Stream'] = stream
+    return Document(page_content=f'Title: {title}. Overview: A film about {title}. '
+                                 f'Keywords: one, two',
+                    metadata=metadata)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_render_doc_keeps_prompt_fields_only():
+    rendered = render_doc(make_doc('1', 'Heat', ['Netflix', 'Max']))
+    assert rendered == ('Title: Heat\nRuntime: 120 minutes\nRelease Year: 2001\n'
+                        'Streaming: Netflix, Max\nOverview: A film about Heat.')
+    assert 'Apple TV' not in rendered
+    assert 'Streaming: None' in render_doc(make_doc('2', 'Big'))
+
+
+def test_overview_without_keywords():
+    doc = Document(page_content='Title: Heat. Overview: A heist.', metadata={})
+    assert overview(doc) == 'A heist.'
+
+
+def test_build_context_dedupes_and_respects_budget():
+    docs = [make_doc('1', 'Heat'), make_doc('1', 'Heat'), make_doc('2', 'Big'),
+            make_doc('3', 'Alien')]
+    per_doc = count_words(render_doc(docs[0]))
+
+    context = build_context(docs, per_doc * 2, count_words)
+    assert context.count('Title: ') == 2
+    assert 'Title: Alien' not in context
+
+
+def test_build_context_shortens_first_film_over_budget():
+    doc = make_doc('1', 'Heat')
+    per_doc = count_words(render_doc(doc))
+
+    context = build_context([doc, make_doc('2', 'Big')], per_doc - 2, count_words)
+    assert context == render_doc(doc, 2)
+    assert context.endswith('Overview: A film...')
+    assert count_words(context) <= per_doc - 2
@@ -0,0 +1,62 @@
+import asyncio
+
+from langchain_core.embeddings import Embeddings
+from ..embedding_cache import CachedEmbeddings, EmbeddingCache, QueryEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_second_run_needs_no_embedding_calls(tmp_path):
+    texts = ['Title: A', 'Title: BB', 'Title: A']
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, EmbeddingCache(tmp_path, 'model'))
+    first = embeddings.embed_documents(texts)
+    assert inner.calls == [['Title: A', 'Title: BB']]
+
+    # A fresh process reads the cache back from disk
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, EmbeddingCache(tmp_path, 'model'))
+    assert embeddings.embed_documents(texts) == first
+    assert embeddings.embed_query('Title: BB') == first[1]
+    assert inner.calls == []
+    assert embeddings.hits == 4
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', max_entries=2)
+    cache.put(['a', 'b'], [[1.0], [2.0]])
+    cache.get(['a'])
+    cache.put(['c'], [[3.0]])
+    assert len(cache) == 2
+    assert cache.get(['a', 'b', 'c']) == [[1.0], None, [3.0]]
+
+
+def test_async_query_embedding_shares_the_cache(tmp_path):
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, EmbeddingCache(tmp_path, 'model'))
+    vector = asyncio.run(embeddings.aembed_query('Title: A'))
+    assert asyncio.run(embeddings.aembed_query('Title: A')) == vector
+    assert embeddings.embed_query('Title: A') == vector
+    assert len(inner.calls) == 1
+
+
+def test_query_embeddings_stay_in_memory(tmp_path):
+    inner = CountingEmbeddings()
+    embeddings = QueryEmbeddings(inner, max_entries=2)
+    vector = embeddings.embed_query('dogs')
+    assert asyncio.run(embeddings.aembed_query('dogs')) == vector
+    embeddings.embed_query('cats')
+    embeddings.embed_query('birds')
+    embeddings.embed_query('dogs')
+    assert inner.calls == [['dogs'], ['cats'], ['birds'], ['dogs']]
+    assert embeddings.hits == 1
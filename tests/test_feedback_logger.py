@@ -0,0 +1,78 @@
+import json
+
+from ..feedback_logger import FEEDBACK_COLUMNS, FeedbackLogger
+
+
+class FakeRun:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.tables = []
+        self.finished = False
+
+    def log(self, data):
+        if self.fail:
+            raise ConnectionError('W&B is down')
+        self.tables.append(data['Query Log'].data)
+
+    def finish(self):
+        self.finished = True
+
+
+def make_logger(tmp_path, run, **kwargs):
+    inits = []
+
+    def init_run(**kwargs):
+        inits.append(kwargs)
+        return run
+
+    logger = FeedbackLogger(spill_path=str(tmp_path / 'spill.jsonl'),
+                            init_run=init_run, **kwargs)
+    return logger, inits
+
+
+def log_feedback(logger, n):
+    for i in range(n):
+        logger.log('positive', f'query {i}', '{}', 'context', 'answer')
+
+
+def test_batches_go_to_one_run(tmp_path):
+    run = FakeRun()
+    logger, inits = make_logger(tmp_path, run, batch_size=2, flush_seconds=60)
+    log_feedback(logger, 5)
+    logger.close()
+
+    assert len(inits) == 1
+    assert sum(len(rows) for rows in run.tables) == 5
+    assert all(len(rows) <= 2 for rows in run.tables)
+    assert run.tables[0][0] == ['positive', 'query 0', '{}', 'context', 'answer']
+    assert run.finished
+    assert logger.logged == 5
+
+
+def test_failed_batches_spill_and_are_resent(tmp_path):
+    run = FakeRun(fail=True)
+    logger, _ = make_logger(tmp_path, run, batch_size=10, flush_seconds=60)
+    # Batches go straight to _send, so the worker never sees them and the
+    # order of sends is fixed
+    records = [dict(zip(FEEDBACK_COLUMNS, ['positive', f'query {i}', '{}', 'context', 'answer']))
+               for i in range(4)]
+    logger._send(records[:3])
+    with open(tmp_path / 'spill.jsonl') as f:
+        assert [json.loads(line)['query'] for line in f] == ['query 0', 'query 1', 'query 2']
+    assert run.tables == []
+
+    run.fail = False
+    logger._send(records[3:])
+    assert [row[1] for row in run.tables[0]] == ['query 3']
+    logger.close()
+    assert sorted(row[1] for rows in run.tables for row in rows) == \
+        ['query 0', 'query 1', 'query 2', 'query 3']
+    assert not (tmp_path / 'spill.jsonl').exists()
+
+
+def test_full_queue_spills_instead_of_blocking(tmp_path):
+    logger, _ = make_logger(tmp_path, FakeRun(fail=True), batch_size=100,
+                            flush_seconds=60, max_queue=1)
+    log_feedback(logger, 3)
+    assert logger.spilled >= 1
+    logger.close()
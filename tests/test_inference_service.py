@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import httpx
+from starlette.testclient import TestClient
+from ..inference_service import create_app, iter_events, sse_event
+from ..metrics import LatencyMetrics
+
+CONFIG = {'service_max_concurrency': 1, 'service_queue_timeout_seconds': 0.1}
+
+
+class FakeModel:
+    def __init__(self, release=None):
+        self.release = release
+        self.latency_metrics = LatencyMetrics()
+
+    async def apredict_stream(self, query, state):
+        state['query_constructor'] = json.dumps({'query': query})
+        state['context'] = 'Title: Heat'
+        if self.release is not None:
+            await self.release.wait()
+        for chunk in ['Watch ', 'Heat.\n']:
+            yield chunk
+
+
+def test_recommend_streams_events():
+    with TestClient(create_app(FakeModel(), CONFIG)) as client:
+        response = client.post('/recommend', json={'query': 'heists'})
+        assert response.headers['content-type'].startswith('text/event-stream')
+        events = list(iter_events(response.text.split('\n')))
+
+    assert events == [('query_constructor', '{"query": "heists"}'),
+                      ('context', 'Title: Heat'),
+                      ('answer', 'Watch '),
+                      ('answer', 'Heat.\n'),
+                      ('done', {})]
+
+
+def test_metrics_reports_stage_percentiles():
+    model = FakeModel()
+    model.latency_metrics.record('retrieval', 0.2)
+    with TestClient(create_app(model, CONFIG)) as client:
+        assert client.get('/metrics').json()['retrieval']['p50'] == 0.2
+
+
+def test_recommend_requires_query():
+    with TestClient(create_app(FakeModel(), CONFIG)) as client:
+        assert client.post('/recommend', json={}).status_code == 400
+
+
+def test_recommend_pushes_back_when_busy():
+    release = asyncio.Event()
+    app = create_app(FakeModel(release), CONFIG)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            first = asyncio.create_task(client.post('/recommend', json={'query': 'a'}))
+            await asyncio.sleep(0.05)
+            busy = await client.post('/recommend', json={'query': 'b'})
+            release.set()
+            return busy, await first, await client.post('/recommend', json={'query': 'c'})
+
+    busy, first, after = asyncio.run(run())
+    assert busy.status_code == 503
+    assert 'Retry-After' in busy.headers
+    assert first.status_code == 200
+    assert after.status_code == 200
+
+
+def test_disconnect_before_first_event_frees_slot():
+    app = create_app(FakeModel(), CONFIG)
+    body = json.dumps({'query': 'a'}).encode('utf-8')
+    scope = {'type': 'http', 'method': 'POST', 'path': '/recommend', 'headers': [],
+             'query_string': b'', 'http_version': '1.1', 'scheme': 'http',
+             'server': ('test', 80), 'client': ('test', 1), 'root_path': ''}
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        # The client is gone before the response starts
+        raise OSError('connection closed')
+
+    async def run():
+        try:
+            await app(scope, receive, send)
+        except OSError:
+            pass
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.post('/recommend', json={'query': 'b'})
+
+    assert asyncio.run(run()).status_code == 200
+
+
+def test_sse_event_round_trip():
+    lines = (sse_event('answer', 'a\nb') + sse_event('done', {})).split('\n')
+    assert list(iter_events(lines)) == [('answer', 'a\nb'), ('done', {})]
@@ -0,0 +1,70 @@
+from langchain.chains.query_constructor.ir import Comparator, Comparison, Operation, Operator
+from langchain_community.query_constructors.pinecone import PineconeTranslator
+from langchain_core.documents import Document
+from ..local_vector_store import LocalVectorStore, matches_filter
+
+FILMS = [
+    ({'Title': 'Heat', 'Genre': ['Crime', 'Thriller'], 'Rating': 8.3,
+      'Actors': ['Al Pacino', 'Robert De Niro']}, [1.0, 0.0]),
+    ({'Title': 'Big', 'Genre': ['Comedy'], 'Rating': 7.3,
+      'Actors': ['Tom Hanks']}, [0.8, 0.6]),
+    ({'Title': 'Alien', 'Genre': ['Horror', 'Science Fiction'], 'Rating': 8.5,
+      'Actors': ['Sigourney Weaver']}, [0.0, 1.0]),
+]
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return {'crime': [1.0, 0.0], 'space': [0.0, 1.0]}[text]
+
+
+def make_store():
+    docs = [Document(page_content=f"Title: {metadata['Title']}", metadata=metadata)
+            for metadata, _ in FILMS]
+    return LocalVectorStore(FakeEmbeddings(), [vector for _, vector in FILMS], docs)
+
+
+def make_filter(operation):
+    return PineconeTranslator().visit_operation(operation)
+
+
+def test_list_fields_match_any_element():
+    heat = FILMS[0][0]
+    assert matches_filter(heat, {'Genre': {'$eq': 'Crime'}})
+    assert matches_filter(heat, {'Genre': {'$in': ['Drama', 'Thriller']}})
+    assert not matches_filter(heat, {'Actors': {'$nin': ['Al Pacino']}})
+    assert not matches_filter(heat, {'Genre': {'$ne': 'Thriller'}})
+
+
+def test_missing_fields_only_match_negations():
+    assert not matches_filter({}, {'Rating': {'$gt': 7}})
+    assert matches_filter({}, {'Actors': {'$nin': ['Tom Hanks']}})
+
+
+def test_translated_filter():
+    filter = make_filter(Operation(operator=Operator.AND, arguments=[
+        Comparison(comparator=Comparator.GT, attribute='Rating', value=8),
+        Comparison(comparator=Comparator.NIN, attribute='Genre', value=['Horror']),
+    ]))
+    assert [film['Title'] for film, _ in FILMS if matches_filter(film, filter)] == ['Heat']
+
+    filter = make_filter(Operation(operator=Operator.OR, arguments=[
+        Comparison(comparator=Comparator.EQ, attribute='Genre', value='Comedy'),
+        Comparison(comparator=Comparator.GTE, attribute='Rating', value=8.5),
+    ]))
+    assert [film['Title'] for film, _ in FILMS if matches_filter(film, filter)] == ['Big', 'Alien']
+
+
+def test_search_ranks_by_cosine_similarity():
+    store = make_store()
+    assert [doc.metadata['Title'] for doc in store.similarity_search('crime', k=2)] == ['Heat', 'Big']
+    docs = store.similarity_search('crime', k=2, filter={'Genre': {'$nin': ['Crime']}})
+    assert [doc.metadata['Title'] for doc in docs] == ['Big', 'Alien']
+
+
+def test_save_and_load(tmp_path):
+    store = make_store()
+    LocalVectorStore.save(store.vectors, store.documents, str(tmp_path))
+    loaded = LocalVectorStore.load(FakeEmbeddings(), str(tmp_path))
+    assert [doc.metadata['Title'] for doc in loaded.similarity_search('space', k=1)] == ['Alien']
+    assert loaded.documents[0].metadata == FILMS[0][0]
@@ -0,0 +1,63 @@
+import numpy as np
+from langchain_core.documents import Document
+from ..local_vector_store import LocalVectorStore, matches_filter
+from ..metadata_index import MetadataIndex
+
+METADATAS = [
+    {'Title': 'Heat', 'Genre': ['Crime', 'Thriller'], 'Rating': 8.3,
+     'Runtime (minutes)': 170, 'Actors': ['Al Pacino', 'Robert De Niro']},
+    {'Title': 'Big', 'Genre': ['Comedy'], 'Rating': 7.3,
+     'Runtime (minutes)': 104, 'Actors': ['Tom Hanks']},
+    {'Title': 'Alien', 'Genre': ['Horror', 'Science Fiction'], 'Rating': 8.5,
+     'Runtime (minutes)': 117},
+    {'Title': 'Short', 'Genre': [], 'Rating': 7.0, 'Runtime (minutes)': 30},
+]
+
+FILTERS = [
+    {'Genre': {'$eq': 'Crime'}},
+    {'Genre': {'$ne': 'Crime'}},
+    {'Genre': {'$in': ['Comedy', 'Horror']}},
+    {'Actors': {'$nin': ['Tom Hanks']}},
+    {'Rating': {'$gt': 7.3}},
+    {'Rating': {'$gte': 7.3}},
+    {'Runtime (minutes)': {'$lt': 117}},
+    {'Runtime (minutes)': {'$lte': 117}},
+    {'Rating': {'$eq': 7}},
+    {'Title': 'Big'},
+    {'Title': {'$gt': 'A'}},
+    {'$and': [{'Genre': {'$nin': ['Horror']}}, {'Rating': {'$gt': 7}}]},
+    {'$or': [{'Genre': {'$eq': 'Comedy'}}, {'Runtime (minutes)': {'$lt': 40}}]},
+    {'Genre': {'$eq': 'Western'}},
+]
+
+
+def test_index_agrees_with_matches_filter():
+    index = MetadataIndex(METADATAS)
+    for filter in FILTERS:
+        expected = [matches_filter(metadata, filter) for metadata in METADATAS]
+        assert index.evaluate(filter).tolist() == expected, filter
+
+
+def test_count():
+    index = MetadataIndex(METADATAS)
+    assert index.count({'Rating': {'$gt': 8}}) == 2
+    assert index.count({'Genre': {'$eq': 'Western'}}) == 0
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [1.0, 0.0]
+
+
+def test_zero_match_filter_skips_query_embedding():
+    embeddings = CountingEmbeddings()
+    docs = [Document(page_content=m['Title'], metadata=m) for m in METADATAS]
+    store = LocalVectorStore(embeddings, np.ones((4, 2)) / np.sqrt(2), docs)
+    assert store.similarity_search('q', filter={'Genre': {'$eq': 'Western'}}) == []
+    assert embeddings.calls == 0
+    assert len(store.similarity_search('q', k=2, filter={'Rating': {'$gt': 7}})) == 2
+    assert embeddings.calls == 1
@@ -0,0 +1,38 @@
+import json
+import time
+
+from ..metrics import LatencyMetrics
+
+
+def test_snapshot_percentiles():
+    metrics = LatencyMetrics()
+    for value in range(1, 101):
+        metrics.record('retrieval', value / 1000)
+    summary = metrics.snapshot()['retrieval']
+    assert summary['count'] == 100
+    assert summary['p50'] == 0.0505
+    assert 0.095 < summary['p95'] < summary['p99'] < summary['max'] == 0.1
+
+
+def test_span_records_elapsed_seconds():
+    metrics = LatencyMetrics()
+    with metrics.span('query_constructor'):
+        time.sleep(0.01)
+    assert metrics.snapshot()['query_constructor']['max'] >= 0.01
+
+
+def test_window_is_bounded_but_count_is_not():
+    metrics = LatencyMetrics(max_samples=10)
+    for value in range(100):
+        metrics.record('first_token', value)
+    summary = metrics.snapshot()['first_token']
+    assert summary['count'] == 100
+    assert summary['p50'] == 94.5
+
+
+def test_dump(tmp_path):
+    metrics = LatencyMetrics()
+    metrics.record('last_token', 1.0)
+    metrics.dump(str(tmp_path / 'metrics' / 'latency.json'))
+    with open(tmp_path / 'metrics' / 'latency.json') as f:
+        assert json.load(f)['last_token']['p99'] == 1.0
@@ -0,0 +1,49 @@
+import math
+
+from .. import offline_eval
+from ..offline_eval import RagasJudge
+
+
+class FakeScores:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def to_list(self):
+        return self.rows
+
+
+class FakeEvaluation:
+    def __init__(self, scores):
+        self.scores = FakeScores(scores)
+
+
+def make_row(i):
+    return {'question': f'question {i}', 'answer': f'answer {i}', 'context': 'Title: Heat'}
+
+
+def test_score_batches_rows_and_caches_them(tmp_path, monkeypatch):
+    batches = []
+
+    def evaluate(dataset, **kwargs):
+        batches.append(dataset['question'])
+        return FakeEvaluation([{'answer_relevancy': 0.5, 'context_relevancy': 0.25,
+                                'faithfulness': 1.0 if question != 'question 2' else math.nan}
+                               for question in dataset['question']])
+
+    monkeypatch.setattr(offline_eval, 'evaluate', evaluate)
+    path = str(tmp_path / 'judge_cache.json')
+    judge = RagasJudge('judge', 'embeddings', cache_path=path, llm=object(), embeddings=object())
+    saves = []
+    save = judge.cache.save
+    monkeypatch.setattr(judge.cache, 'save', lambda: saves.append(1) or save())
+
+    scores = judge.score([make_row(i) for i in range(3)])
+    assert len(saves) == 1
+    assert batches == [['question 0', 'question 1', 'question 2']]
+    assert scores[0] == {'answer_relevancy': 0.5, 'context_relevancy': 0.25, 'faithfulness': 1.0}
+
+    # Cached rows are not judged again, even by a new judge, but a row with
+    # a failed metric is
+    judge = RagasJudge('judge', 'embeddings', cache_path=path, llm=object(), embeddings=object())
+    judge.score([make_row(i) for i in range(4)])
+    assert batches[1] == ['question 2', 'question 3']
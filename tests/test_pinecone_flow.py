@@ -0,0 +1,46 @@
+from langchain_core.documents import Document
+from ..pinecone_flow import batch_by_tokens, embed_and_upsert
+from ..vector_sync import HASH_FIELD, doc_hash
+
+CONFIG = {'embedding_batch_tokens': 10, 'embedding_batch_size': 3,
+          'embedding_concurrency': 2, 'upsert_batch_size': 2,
+          'upsert_concurrency': 2}
+
+
+def make_docs(n):
+    return [Document(page_content='one two three',
+                     metadata={'Title': f'Film {i}', 'TMDB ID': str(i)})
+            for i in range(n)]
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_batch_by_tokens():
+    batches = list(batch_by_tokens(make_docs(7), 10, 5, count_words))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+
+class FakeIndex:
+    def __init__(self):
+        self.upserts = []
+
+    def upsert(self, vectors, namespace, show_progress):
+        self.upserts.append(vectors)
+
+
+def test_embed_and_upsert():
+    index = FakeIndex()
+    embed_and_upsert(make_docs(7), FakeEmbeddings(), index, 'ns', CONFIG,
+                     count_tokens=count_words)
+    records = [record for batch in index.upserts for record in batch]
+    assert sorted(record['id'] for record in records) == [str(i) for i in range(7)]
+    assert all(len(batch) <= 2 for batch in index.upserts)
+    assert records[0]['metadata']['text'] == 'one two three'
+    assert records[0]['metadata'][HASH_FIELD] == doc_hash(make_docs(1)[0])
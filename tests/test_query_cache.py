@@ -0,0 +1,104 @@
+from ..query_cache import (PersistentLRUCache, SemanticQueryCache, StructuredQueryCache,
+                           normalize_query, replay_stream)
+
+
+class FakeEmbeddings:
+    """
+    Maps each text to a fixed vector, so similarity is under test control.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def test_normalize_query():
+    assert normalize_query('  Films  about DOGS?! ') == 'films about dogs'
+
+
+def test_replay_stream_rebuilds_answer():
+    answer = '- **Heat**:\n    - Runtime: 170\n'
+    chunks = list(replay_stream(answer))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == answer
+
+
+def test_exact_hit_after_normalization():
+    cache = SemanticQueryCache()
+    cache.put('Films about dogs', {'answer': 'a'})
+    assert cache.get('films about dogs.') == {'answer': 'a'}
+    assert cache.get('films about cats') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_similar_query_hits_above_threshold():
+    embeddings = FakeEmbeddings({'films about dogs': [1.0, 0.0],
+                                 'movies about dogs': [0.99, 0.05],
+                                 'films about space': [0.0, 1.0]})
+    cache = SemanticQueryCache(embeddings, similarity_threshold=0.95)
+    cache.put('films about dogs', {'answer': 'a'})
+    assert cache.get('movies about dogs') == {'answer': 'a'}
+    assert cache.get('films about space') is None
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    cache = SemanticQueryCache(ttl_seconds=10)
+    cache.put('q', {'answer': 'a'})
+    now[0] += 11
+    assert cache.get('q') is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticQueryCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_catalog_version_change_clears_cache():
+    version = ['v1']
+    cache = SemanticQueryCache(version_fn=lambda: version[0])
+    cache.put('q', {'answer': 'a'})
+    assert cache.get('q') is not None
+    version[0] = 'v2'
+    assert cache.get('q') is None
+
+
+def test_structured_query_cache_persists(tmp_path):
+    path = str(tmp_path / 'sq.json')
+    cache = StructuredQueryCache(path, fingerprint='v1')
+    assert cache.get('Films about dogs') is None
+    cache.put('Films about dogs', '{"query": "dogs"}')
+
+    reloaded = StructuredQueryCache(path, fingerprint='v1')
+    assert reloaded.get('films about dogs?') == '{"query": "dogs"}'
+    assert reloaded.stats()['hits'] == 1
+    assert len(StructuredQueryCache(path, fingerprint='v2')) == 0
+
+
+def test_structured_query_cache_is_bounded():
+    cache = StructuredQueryCache(max_entries=2)
+    for query in ['a', 'b', 'c']:
+        cache.put(query, query)
+    assert 'a' not in cache
+    assert cache.stats() == {'entries': 2, 'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+
+
+def test_persistent_cache_keeps_keys_and_writes_on_save(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = PersistentLRUCache(str(path), fingerprint='v1')
+    cache.put('Key A', {'score': 1.0})
+    cache.put('key a', {'score': 0.0})
+    assert not path.exists()
+
+    cache.save()
+    reloaded = PersistentLRUCache(str(path), fingerprint='v1')
+    assert reloaded.get('Key A') == {'score': 1.0}
+    assert reloaded.get('key a') == {'score': 0.0}
@@ -0,0 +1,24 @@
+from ..utils import movie_record
+from ..records import export_csv, record_to_document
+
+
+def test_record_to_document_keeps_types(my_movie):
+    movie = dict(my_movie, vote_average=7.25,
+                 production_companies=[{'name': 'Studio, Inc.'}])
+    doc = record_to_document(movie_record(movie))
+    assert doc.page_content == ('Title: Test Movie. Overview: This is a test movie.'
+                                ' Keywords: Test Keyword')
+    assert doc.metadata['Runtime (minutes)'] == 120
+    assert doc.metadata['Release Year'] == 2020
+    assert doc.metadata['Rating'] == 7.2
+    assert doc.metadata['Stream'] == ['Test Stream Service']
+    assert doc.metadata['Production Companies'] == ['Studio, Inc.']
+    assert doc.metadata['TMDB ID'] == '1234'
+
+
+def test_export_csv(tmp_path, my_movie):
+    filename = tmp_path / 'export.csv'
+    export_csv(filename, [movie_record(dict(my_movie, vote_average=7.0))])
+    lines = filename.read_text().splitlines()
+    assert lines[0].startswith('Title,Runtime (minutes)')
+    assert lines[1].endswith(',7.0,1234')
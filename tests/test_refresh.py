@@ -0,0 +1,107 @@
+import copy
+from ..refresh import empty_manifest, incremental_refresh, iter_year_records
+
+POLICY = {'recent_years': 1, 'recent_max_age_days': 1, 'max_age_days': 30}
+DAY = 24 * 60 * 60
+
+
+class FakeClient:
+    api_key = 'key'
+
+    def __init__(self, movie, changed=(), failing_years=(), failing_changes=False):
+        self.movie = movie
+        self.changed = changed
+        self.failing_years = failing_years
+        self.failing_changes = failing_changes
+        self.paths = []
+
+    def get(self, path, params=None, max_retries=None):
+        self.paths.append(path)
+        if path == '/discover/movie':
+            if params['page'] > 1:
+                return {'results': []}
+            year = params['primary_release_year']
+            if year in self.failing_years:
+                return None
+            return {'results': [{'id': f'{year}1'}, {'id': f'{year}2'}]}
+        if path == '/movie/changes':
+            if self.failing_changes:
+                return None
+            return {'results': [{'id': i} for i in self.changed], 'total_pages': 1}
+        return dict(self.movie, id=path.split('/')[-1])
+
+
+def detail_calls(client):
+    return [p for p in client.paths if p.startswith('/movie/') and p != '/movie/changes']
+
+
+def test_incremental_refresh_only_fetches_churn(my_movie):
+    movie = dict(my_movie, vote_average=7.25)
+    manifest, records = empty_manifest(), {}
+
+    client = FakeClient(movie)
+    dirty = incremental_refresh(client, [2019, 2020], manifest, records, POLICY,
+                                now=100 * DAY)
+    assert dirty == {2019, 2020}
+    assert len(detail_calls(client)) == 4
+
+    # A day later only the recent year is stale and one old film changed
+    changed_movie = dict(movie, title='Renamed')
+    client = FakeClient(changed_movie, changed=['20191'])
+    before = copy.deepcopy(manifest)
+    dirty = incremental_refresh(client, [2019, 2020], manifest, records, POLICY,
+                                now=101 * DAY)
+    assert sorted(detail_calls(client)) == ['/movie/20191', '/movie/20201', '/movie/20202']
+    assert dirty == {2019, 2020}
+    assert manifest['movies']['20191']['hash'] != before['movies']['20191']['hash']
+    assert manifest['movies']['20192'] == before['movies']['20192']
+
+    records = list(iter_year_records(manifest, records, 2019))
+    assert [record['TMDB ID'] for record in records] == ['20191', '20192']
+    assert records[0]['Title'] == 'Renamed'
+
+
+def test_failed_discovery_keeps_year(my_movie):
+    movie = dict(my_movie, vote_average=7.25)
+    manifest, records = empty_manifest(), {}
+    incremental_refresh(FakeClient(movie), [2019, 2020], manifest, records, POLICY,
+                        now=100 * DAY)
+    before = copy.deepcopy(manifest['years'])
+
+    # Discovery of 2020 fails a day later: its films and discover time are
+    # kept, so it is tried again next time rather than emptied
+    client = FakeClient(movie, failing_years=[2020])
+    dirty = incremental_refresh(client, [2019, 2020], manifest, records, POLICY,
+                                now=101 * DAY)
+    assert 2020 not in dirty
+    assert manifest['years']['2020'] == before['2020']
+    assert [record['TMDB ID'] for record in iter_year_records(manifest, records, 2020)] == \
+        ['20201', '20202']
+
+
+def test_failed_discovery_of_new_year_has_no_records(my_movie):
+    movie = dict(my_movie, vote_average=7.25)
+    manifest, records = empty_manifest(), {}
+    client = FakeClient(movie, failing_years=[2020])
+    dirty = incremental_refresh(client, [2019, 2020], manifest, records, POLICY,
+                                now=100 * DAY)
+    assert dirty == {2019}
+    assert '2020' not in manifest['years']
+    assert list(iter_year_records(manifest, records, 2020)) == []
+
+
+def test_failed_change_feed_keeps_last_refresh(my_movie):
+    movie = dict(my_movie, vote_average=7.25)
+    manifest, records = empty_manifest(), {}
+    incremental_refresh(FakeClient(movie), [2019, 2020], manifest, records, POLICY,
+                        now=100 * DAY)
+
+    client = FakeClient(movie, failing_changes=True)
+    incremental_refresh(client, [2019, 2020], manifest, records, POLICY, now=101 * DAY)
+    assert manifest['last_refresh'] == 100 * DAY
+    # Stale films are still refreshed
+    assert sorted(detail_calls(client)) == ['/movie/20201', '/movie/20202']
+
+    incremental_refresh(FakeClient(movie), [2019, 2020], manifest, records, POLICY,
+                        now=102 * DAY)
+    assert manifest['last_refresh'] == 102 * DAY
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from ..benchmark import (FakeChatModel, benchmark_config, count_words, fixture_catalog,
+                         structured_query_response, summary_response)
+from ..local_vector_store import LocalVectorStore
+from ..records import iter_documents
+from ..rosebud_chat_model import NO_MATCH_ANSWER, rosebud_chat_model
+
+
+@pytest.fixture
+def model(tmp_path):
+    config = dict(benchmark_config(str(tmp_path)), hybrid_search=False)
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = list(iter_documents(fixture_catalog(30)))
+    LocalVectorStore.save(embeddings.embed_documents([doc.page_content for doc in docs]),
+                          docs, config['local_store_dir'])
+
+    prompts = []
+
+    def construct(prompt):
+        prompts.append(prompt)
+        return structured_query_response(prompt)
+
+    model = rosebud_chat_model(
+        config,
+        retriever_llm=FakeChatModel(respond=construct),
+        summary_llm=FakeChatModel(respond=summary_response),
+        embeddings=embeddings,
+        count_tokens=count_words,
+    )
+    return model, prompts
+
+
+def format_count(model):
+    return model.latency_metrics.snapshot().get('format_context', {}).get('count', 0)
+
+
+def test_query_is_constructed_once_per_request(model):
+    model, constructor_calls = model
+    formatted = format_count(model)
+    state = {}
+    answer = ''.join(model.predict_stream('films about dragons', state))
+    assert answer
+    assert len(constructor_calls) == 1
+    assert json.loads(state['query_constructor'])['query'] == 'films about dragons'
+    assert state['context'].startswith('Title: ')
+
+    result = asyncio.run(model.apredict('films about robots'))
+    assert result['context'].startswith('Title: ')
+    assert len(constructor_calls) == 2
+    assert format_count(model) == formatted + 2
+
+
+def test_empty_context_gets_no_match_answer(model, monkeypatch):
+    model, _ = model
+    monkeypatch.setattr(type(model), 'format_context', lambda self, docs: '')
+    state = {}
+    assert ''.join(model.predict_stream('films about dragons', state)) == NO_MATCH_ANSWER
+    assert state['context'] == ''
+
+
+def test_interleaved_requests_keep_their_own_state(model):
+    model, constructor_calls = model
+    first, second = {}, {}
+    streams = [model.predict_stream('films about dogs', first),
+               model.predict_stream('films about ghosts', second)]
+    # Step both streams in turn, as two sessions sharing the model would
+    while streams:
+        for stream in list(streams):
+            if next(stream, None) is None:
+                streams.remove(stream)
+
+    assert json.loads(first['query_constructor'])['query'] == 'films about dogs'
+    assert json.loads(second['query_constructor'])['query'] == 'films about ghosts'
+    assert len(constructor_calls) == 2
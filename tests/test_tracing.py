@@ -0,0 +1,50 @@
+import pytest
+from weave.trace.context.call_context import get_tracing_enabled
+
+from .. import tracing
+
+
+class FakeClient:
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def fake_weave(monkeypatch):
+    inits = []
+
+    def init(project, settings=None):
+        inits.append((project, settings))
+        return FakeClient()
+
+    monkeypatch.setattr(tracing.weave, 'init', init)
+    monkeypatch.setattr(tracing, 'WeaveTracer', object)
+    monkeypatch.setattr(tracing, '_client', None)
+    monkeypatch.setenv('WEAVE_TRACE_LANGCHAIN', 'true')
+    return inits
+
+
+def test_init_tracing_once_per_process(fake_weave):
+    client = tracing.init_tracing('film-search', sample_rate=0.5)
+    assert tracing.init_tracing('film-search', sample_rate=1.0) is client
+    assert len(fake_weave) == 1
+    assert fake_weave[0][1]['print_call_link'] is False
+    assert tracing._sample_rate == 1.0
+
+
+def test_zero_sample_rate_never_initializes(fake_weave):
+    assert tracing.init_tracing('film-search', sample_rate=0) is None
+    assert fake_weave == []
+    with tracing.trace_request() as traced:
+        assert not traced
+
+
+def test_trace_request_samples(fake_weave, monkeypatch):
+    tracing.init_tracing('film-search', sample_rate=0.3)
+    monkeypatch.setattr(tracing.random, 'random', lambda: 0.2)
+    with tracing.trace_request() as traced:
+        assert traced
+    monkeypatch.setattr(tracing.random, 'random', lambda: 0.5)
+    with tracing.trace_request() as traced:
+        assert not traced
+        assert not get_tracing_enabled()
@@ -1,13 +1,20 @@
+import http.client
+import io
+import json
 from unittest.mock import Mock, patch
-from ..utils import get_id_list, get_data, write_file
+
+import urllib3
+from urllib3.connectionpool import HTTPConnectionPool
+from ..utils import get_id_list, get_data, write_file, discover_ids, fetch_details, RateLimiter, TMDBClient, CSVBatchWriter, ResponseCache
 import os
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
 TMBD_API_KEY = os.getenv('TMBD_API_KEY')
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_get_id_list(mock_get):
     mock_get.return_value = Mock(status_code=200)
     mock_get.return_value.json.return_value = {'results': [
@@ -18,7 +25,7 @@ def test_get_id_list(mock_get):
     assert all(isinstance(i, str) for i in ids)
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_get_data(mock_get, my_movie):
     mock_get.return_value = Mock(status_code=200)
     mock_get.return_value.json.return_value = my_movie
@@ -45,3 +52,136 @@ def test_write_file(tmp_path, my_movie):
         'Drama', 'Test Keyword', 'Test Actor Name', 'Test Director Name',
         'Test Stream Service ', 'Test Buy Service ', 'Test Rent Service ',
         'Test Studio']
+
+
+@patch('requests.Session.get')
+def test_get_data_retries_after_429(mock_get, my_movie):
+    limited = Mock(status_code=429, headers={'Retry-After': '0'})
+    ok = Mock(status_code=200)
+    ok.json.return_value = my_movie
+    mock_get.side_effect = [limited, ok]
+    client = TMDBClient('key', rate_limiter=RateLimiter(rate=1000))
+    data = get_data('key', '1234', client=client)
+    assert data == my_movie
+    assert mock_get.call_count == 2
+    assert client.stats()['requests'] == 2
+
+
+@patch('requests.Session.get')
+def test_error_responses_are_failed_fetches(mock_get):
+    mock_get.return_value = Mock(status_code=404)
+    mock_get.return_value.json.return_value = {'status_code': 34, 'success': False}
+    client = TMDBClient('key', rate_limiter=RateLimiter(rate=1000))
+    assert get_data('key', '1234', client=client) is None
+    assert mock_get.call_count == 1
+    assert list(fetch_details(client, ['1234'])) == []
+
+
+@patch('requests.Session.get')
+def test_discover_and_fetch_details(mock_get, my_movie):
+    def fake_get(url, params=None, timeout=None):
+        response = Mock(status_code=200)
+        if 'discover' in url:
+            response.json.return_value = {'results': [{'id': params['page']}]}
+        else:
+            response.json.return_value = my_movie
+        return response
+
+    mock_get.side_effect = fake_get
+    client = TMDBClient('key', rate_limiter=RateLimiter(rate=1000))
+    ids = discover_ids(client, [2019, 2020], max_workers=4)
+    assert ids == {2019: ['1', '2', '3', '4', '5'],
+                   2020: ['1', '2', '3', '4', '5']}
+    details = dict(fetch_details(client, ids[2020], max_workers=4))
+    assert sorted(details) == ids[2020]
+
+
+def test_rate_limiter_pause():
+    limiter = RateLimiter(rate=1000)
+    limiter.pause(0.05)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.04
+
+
+class FinishedResponse:
+    """
+    Stands in for the socket-level response urllib3 wraps, already read to
+    the end, so urllib3 returns its connection to the pool.
+    """
+    msg = http.client.HTTPMessage()
+
+    def isclosed(self):
+        return True
+
+
+def fake_make_request(pool, conn, method, url, **kwargs):
+    body = json.dumps({'id': 1}).encode()
+    return urllib3.HTTPResponse(body=io.BytesIO(body), status=200,
+                                headers={'Content-Length': str(len(body))},
+                                preload_content=False,
+                                original_response=FinishedResponse(),
+                                pool=pool, connection=conn)
+
+
+def test_client_reuses_connections():
+    client = TMDBClient('key', rate_limiter=RateLimiter(rate=1000))
+    assert client.session.headers['Accept-Encoding'] == 'gzip, deflate'
+    with patch.object(HTTPConnectionPool, '_make_request', fake_make_request):
+        for _ in range(3):
+            assert client.get('/movie/1') == {'id': 1}
+
+    stats = client.stats()
+    assert stats['requests'] == 3
+    assert stats['connections_opened'] == 1
+    assert stats['connections_reused'] == 2
+
+
+def test_csv_batch_writer(tmp_path, my_movie):
+    filename = tmp_path / "test.csv"
+    with CSVBatchWriter(filename, ['Title'], buffer_size=2) as writer:
+        for _ in range(3):
+            writer.write(dict(my_movie, vote_average=7.0))
+    lines = filename.read_text().splitlines()
+    assert len(lines) == 4
+    assert lines[0] == 'Title'
+    assert lines[1].startswith('Test Movie,120,English')
+
+
+def test_csv_batch_writer_keeps_old_file_on_crash(tmp_path):
+    filename = tmp_path / "test.csv"
+    filename.write_text('old\n')
+    try:
+        with CSVBatchWriter(filename, ['Title']) as writer:
+            writer.write_row(['new'])
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert filename.read_text() == 'old\n'
+    assert list(tmp_path.iterdir()) == [filename]
+
+
+@patch('requests.Session.get')
+def test_response_cache_and_offline_replay(mock_get, tmp_path, my_movie):
+    mock_get.return_value = Mock(status_code=200)
+    mock_get.return_value.json.return_value = my_movie
+    cache = ResponseCache(tmp_path, ttls={'/movie/': 3600})
+    client = TMDBClient('key', rate_limiter=RateLimiter(rate=1000), cache=cache)
+    assert get_data('key', '1234', client=client) == my_movie
+    assert get_data('key', '1234', client=client) == my_movie
+    assert mock_get.call_count == 1
+    assert client.stats()['cache_hits'] == 1
+
+    offline = TMDBClient('other key', cache=ResponseCache(tmp_path, ttls={}, offline=True))
+    assert get_data('other key', '1234', client=offline) == my_movie
+    assert get_data('other key', '5678', client=offline) is None
+    assert mock_get.call_count == 1
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path, ttls={'/movie/': 3600}, max_bytes=150)
+    cache.put('/movie/1', {}, {'overview': 'x' * 50})
+    cache.put('/movie/2', {}, {'overview': 'x' * 50})
+    cache.put('/movie/3', {}, {'overview': 'x' * 50})
+    assert cache.get('/movie/1', {}) is None
+    assert cache.get('/movie/3', {}) is not None
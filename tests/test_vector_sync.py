@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+from .. import vector_sync
+from ..vector_sync import HASH_FIELD, doc_hash, fetch_indexed_hashes, plan_sync
+
+
+def make_doc(id, overview):
+    return Document(page_content=f'Title: Film {id}. Overview: {overview}',
+                    metadata={'Title': f'Film {id}', 'TMDB ID': id})
+
+
+def test_plan_sync_only_touches_churn():
+    unchanged, changed, new = make_doc('1', 'a'), make_doc('2', 'b'), make_doc('3', 'c')
+    indexed = {'1': doc_hash(unchanged), '2': doc_hash(make_doc('2', 'old')),
+               'gone': 'x'}
+    to_upsert, to_delete = plan_sync([unchanged, changed, new], indexed)
+    assert [doc.metadata['TMDB ID'] for doc in to_upsert] == ['2', '3']
+    assert to_delete == ['gone']
+
+
+def test_plan_sync_reupserts_vectors_without_hash():
+    doc = make_doc('1', 'a')
+    to_upsert, to_delete = plan_sync([doc], {'1': None})
+    assert to_upsert == [doc]
+    assert to_delete == []
+
+
+class FakeIndex:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.fetches = []
+
+    def list(self, namespace):
+        ids = sorted(self.metadata)
+        yield ids[:2]
+        yield ids[2:]
+
+    def fetch(self, ids, namespace):
+        self.fetches.append(ids)
+        return SimpleNamespace(vectors={
+            id: SimpleNamespace(metadata=self.metadata[id]) for id in ids})
+
+
+def test_fetch_indexed_hashes_reads_metadata(monkeypatch):
+    monkeypatch.setattr(vector_sync, 'FETCH_BATCH_SIZE', 2)
+    index = FakeIndex({'1': {HASH_FIELD: 'a'}, '2': {HASH_FIELD: 'b'}, '3': {'Title': 'Old'}})
+    assert fetch_indexed_hashes(index, 'ns') == {'1': 'a', '2': 'b', '3': None}
+    assert index.fetches == [['1', '2'], ['3']]
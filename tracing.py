@@ -0,0 +1,65 @@
+import atexit
+import contextlib
+import os
+import random
+import threading
+
+import weave
+from weave.integrations.langchain.langchain import WeaveTracer, weave_tracing_callback_var
+from weave.trace.context.call_context import set_tracing_enabled
+
+_lock = threading.Lock()
+_client = None
+_sample_rate = 0.0
+
+
+def init_tracing(project='film-search', sample_rate=1.0, client_parallelism=None):
+    """
+    Starts Weave tracing for this process. Safe to call from every entry
+    point: only the first call creates the client, later calls only update
+    the sample rate. With a sample rate of 0 Weave is never initialized.
+
+    Weave already exports calls from a background thread in batches; the
+    client is flushed at exit so sampled traces are not lost.
+
+    parameters:
+    project (str): Weave project to log to
+    sample_rate (float): Fraction of requests traced by trace_request
+    client_parallelism (int): Threads the Weave client uses for uploads
+
+    returns:
+    WeaveClient: The client, or None if tracing is off
+    """
+    global _client, _sample_rate
+    with _lock:
+        _sample_rate = sample_rate
+        if _client is None and sample_rate > 0:
+            settings = {'print_call_link': False}
+            if client_parallelism:
+                settings['client_parallelism'] = client_parallelism
+            _client = weave.init(project, settings=settings)
+            # weave.init traces every LangChain run; from here on only runs
+            # inside a sampled trace_request are traced
+            os.environ['WEAVE_TRACE_LANGCHAIN'] = 'false'
+            atexit.register(_client.flush)
+    return _client
+
+
+@contextlib.contextmanager
+def trace_request():
+    """
+    Decides once per request whether it is traced. Inside a sampled request
+    LangChain runs and Weave ops are logged; otherwise nothing is.
+
+    Yields True if the request is traced.
+    """
+    if _client is None or random.random() >= _sample_rate:
+        with set_tracing_enabled(False):
+            yield False
+        return
+
+    token = weave_tracing_callback_var.set(WeaveTracer())
+    try:
+        yield True
+    finally:
+        weave_tracing_callback_var.reset(token)
@@ -1,47 +1,350 @@
 import requests
+from requests.adapters import HTTPAdapter
 import csv
+import os
 import time
+import datetime
+import hashlib
+import json
 from iso639 import languages
 import openai
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+ID_PAGES_PER_YEAR = 5  # 5 pages of ids = 100 movies
 
-def get_id_list(api_key, year, max_retries=5):
+
+class RateLimiter:
     """
-    Function to get list of IDs for all films made in {year}.
+    Thread-safe token bucket shared by every worker that talks to TMDB.
+    Tokens refill at {rate} per second up to {capacity}. A 429 response
+    pauses all callers for the duration given in its Retry-After header.
 
     parameters:
-    api_key (str): API key for TMDB
-    year (int): Year of interest
+    rate (float): Sustained number of requests allowed per second
+    capacity (int): Maximum burst size, defaults to {rate}
+    """
 
-    returns:
-    list of str: List of all movie ids in {year}
+    def __init__(self, rate=40, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    elapsed = now - self._updated
+                    self._tokens = min(self.capacity,
+                                       self._tokens + elapsed * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for {seconds}, e.g. after a 429 response.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+            self._tokens = 0
+
+
+def retry_after_seconds(response, default=1.0):
     """
-    url = f'https://api.themoviedb.org/3/discover/movie?api_key={api_key}&primary_release_year={year}&include_video=false&language=en-US&sort_by=popularity.desc'
+    Number of seconds TMDB asked us to wait, read from the Retry-After header.
+    """
+    try:
+        return max(float(response.headers.get('Retry-After', default)), 0.0)
+    except (TypeError, ValueError):
+        return default
 
-    movie_ids = []
 
-    total_pages = 5  # 5 pages of ids = 100 movies
-    for page in range(1, total_pages + 1):
+class ResponseCache:
+    """
+    On-disk cache of raw TMDB responses keyed by URL (minus the API key).
+    Each endpoint gets its own time-to-live, and the least recently used
+    responses are deleted once the cache grows past {max_bytes}. In offline
+    mode entries never expire and nothing is fetched, so a flow can be
+    replayed against a fixed snapshot.
+
+    parameters:
+    directory (str): Folder holding the cached responses
+    ttls (dict): Endpoint path prefix to time-to-live in seconds. The
+    longest matching prefix wins.
+    max_bytes (int): Maximum total size of the cache
+    offline (bool): Serve everything from the cache, ignoring TTLs
+    """
+
+    def __init__(self, directory, ttls, max_bytes=500 * 1024 * 1024,
+                 offline=False):
+        self.directory = directory
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._paths())
+
+    def _paths(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                yield os.path.join(self.directory, name)
+
+    def _path(self, path, params):
+        params = sorted((key, str(value)) for key, value in params.items()
+                        if key != 'api_key')
+        url = path + '?' + '&'.join(f'{key}={value}' for key, value in params)
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{key}.json')
+
+    def ttl(self, path):
+        prefixes = [prefix for prefix in self.ttls if path.startswith(prefix)]
+        if not prefixes:
+            return 0
+        return self.ttls[max(prefixes, key=len)]
+
+    def get(self, path, params):
+        """
+        Cached body of GET {path}, or None if missing or expired.
+        """
+        file_path = self._path(path, params)
+        try:
+            with open(file_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if not self.offline and time.time() - entry['fetched_at'] > self.ttl(path):
+            return None
+        # Touch the file so eviction sees it as recently used
+        os.utime(file_path)
+        return entry['body']
+
+    def put(self, path, params, body):
+        if self.ttl(path) <= 0:
+            return
+        file_path = self._path(path, params)
+        data = json.dumps({'fetched_at': time.time(), 'body': body})
+        tmp_path = f'{file_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+
+        with self._lock:
+            if os.path.exists(file_path):
+                self._size -= os.path.getsize(file_path)
+            os.replace(tmp_path, file_path)
+            self._size += len(data.encode('utf-8'))
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Delete least recently used responses until we are at 90% capacity
+        paths = sorted(self._paths(), key=os.path.getmtime)
+        for path in paths:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+
+
+class TMDBClient:
+    """
+    Reusable TMDB client. Holds a keep-alive connection pool so thousands of
+    calls share a handful of TCP+TLS connections, asks for gzip-compressed
+    responses, and owns the retry/backoff policy for every TMDB request.
+
+    parameters:
+    api_key (str): API key for TMDB
+    rate_limiter (RateLimiter): Limiter shared by all callers of this client
+    pool_size (int): Maximum number of pooled keep-alive connections
+    max_retries (int): Attempts per request before giving up
+    timeout (float): Seconds to wait for TMDB before retrying
+    cache (ResponseCache): Optional cache checked before every request
+    """
+    BASE_URL = 'https://api.themoviedb.org/3'
+
+    def __init__(self, api_key, rate_limiter=None, pool_size=16,
+                 max_retries=5, timeout=30, cache=None):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json',
+                                     'Accept-Encoding': 'gzip, deflate'})
+        self.session.mount('https://', HTTPAdapter(pool_connections=1,
+                                                   pool_maxsize=pool_size,
+                                                   pool_block=True))
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._latency = 0.0
+        self._cache_hits = 0
+
+    def get(self, path, params=None, max_retries=None):
+        """
+        GET {path} from TMDB and return the decoded JSON body, serving it
+        from the response cache when possible.
+
+        429 responses pause every caller for the Retry-After duration, while
+        server errors and dropped connections back off exponentially.
+        Returns None if every attempt failed, TMDB answered with any other
+        error status, or the response is not cached in offline mode.
+        """
+        max_retries = max_retries or self.max_retries
+        params = {'api_key': self.api_key, **(params or {})}
+
+        if self.cache is not None:
+            body = self.cache.get(path, params)
+            if body is not None:
+                with self._lock:
+                    self._cache_hits += 1
+                return body
+            if self.cache.offline:
+                print(f"{path} is not in the response cache (offline mode)")
+                return None
+
         for i in range(max_retries):
-            response = requests.get(url + f'&page={page}')
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(self.BASE_URL + path,
+                                            params=params,
+                                            timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"Request to {path} failed: {e}. "
+                      f"Retrying ({i + 1}/{max_retries})")
+                time.sleep(2 ** i)
+                continue
+            finally:
+                self._record(time.perf_counter() - start)
+
             if response.status_code == 429:
-                # If the response was a 429, wait and then try again
+                # If the response was a 429, pause every worker and try again
                 print(
                     f"Request limit reached. Waiting and retrying ({i + 1}/{max_retries})")
-                time.sleep(2 ** i)  # Exponential backoff
-
+                self.rate_limiter.pause(retry_after_seconds(response))
+            elif response.status_code >= 500:
+                print(f"TMDB returned {response.status_code}. "
+                      f"Retrying ({i + 1}/{max_retries})")
+                time.sleep(2 ** i)
+            elif not 200 <= response.status_code < 300:
+                # Client errors such as 401 or 404 will not go away on a
+                # retry, and their body is an error rather than the resource
+                print(f"TMDB returned {response.status_code} for {path}")
+                return None
             else:
-                # If the response was not a 429, continue
-                dict = response.json()
-                for film in dict['results']:
-                    movie_ids.append(str(film['id']))
-                break
+                body = response.json()
+                if self.cache is not None and response.status_code == 200:
+                    self.cache.put(path, params, body)
+                return body
+
+    def _record(self, seconds):
+        with self._lock:
+            self._requests += 1
+            self._latency += seconds
+
+    def stats(self):
+        """
+        Cache, connection-reuse and latency counters for this client.
+
+        returns:
+        dict: Cache hits, requests sent, connections opened and reused, and
+        latency
+        """
+        pools = self.session.get_adapter(self.BASE_URL).poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        with self._lock:
+            requests_sent, latency = self._requests, self._latency
+            cache_hits = self._cache_hits
+        return {
+            'cache_hits': cache_hits,
+            'requests': requests_sent,
+            'connections_opened': connections,
+            'connections_reused': max(requests_sent - connections, 0),
+            'total_latency_seconds': round(latency, 3),
+            'mean_latency_ms': round(1000 * latency / requests_sent, 2) if requests_sent else 0.0,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key):
+    """
+    Process-wide TMDBClient for {api_key}, created on first use.
+    """
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = TMDBClient(api_key)
+        return _clients[api_key]
+
+
+def get_id_page(api_key, year, page, max_retries=5, client=None):
+    """
+    Function to get one page of IDs for films made in {year}.
+
+    parameters:
+    api_key (str): API key for TMDB
+    year (int): Year of interest
+    page (int): Page of the discover results, starting at 1
+    client (TMDBClient): Client to send the request with
+
+    returns:
+    list of str: Movie ids on that page, or None if it could not be fetched
+    """
+    client = client or get_client(api_key)
+    params = {'primary_release_year': year, 'include_video': 'false',
+              'language': 'en-US', 'sort_by': 'popularity.desc',
+              'page': page}
+
+    dict = client.get('/discover/movie', params, max_retries)
+    if dict is None:
+        return None
+    return [str(film['id']) for film in dict['results']]
+
+
+def get_id_list(api_key, year, max_retries=5, client=None):
+    """
+    Function to get list of IDs for all films made in {year}.
+
+    parameters:
+    api_key (str): API key for TMDB
+    year (int): Year of interest
+    client (TMDBClient): Client to send the requests with
+
+    returns:
+    list of str: List of all movie ids in {year}
+    """
+    movie_ids = []
+    for page in range(1, ID_PAGES_PER_YEAR + 1):
+        movie_ids += get_id_page(api_key, year, page, max_retries, client) or []
 
     return movie_ids
 
 
-def get_data(API_key, Movie_ID, max_retries=5):
+def get_data(API_key, Movie_ID, max_retries=5, client=None):
     """
     Function to pull details of your film of interest in JSON format.
     Assumes desired language is in US-Engish.
@@ -49,25 +352,172 @@ def get_data(API_key, Movie_ID, max_retries=5):
     parameters:
     API_key (str): Your API key for TMBD
     Movie_ID (str): TMDB id for film of interest
+    client (TMDBClient): Client to send the request with
 
     returns:
     dict: JSON formatted dictionary containing all details of your film of
     interest
     """
+    client = client or get_client(API_key)
+    params = {'append_to_response': 'keywords,watch/providers,credits',
+              'language': 'en-US'}
+    return client.get('/movie/' + Movie_ID, params, max_retries)
+
+
+def discover_ids(client, years, max_workers=8):
+    """
+    Concurrently get the ids of the most popular films for every year in
+    {years}.
+
+    parameters:
+    client (TMDBClient): Client to send the requests with
+    years (iterable of int): Years of interest
+    max_workers (int): Maximum number of requests in flight
+
+    returns:
+    dict of int to list of str: Movie ids for each year, most popular first.
+    None for a year if any of its pages could not be fetched, since a
+    partial list would look like films had left the year.
+    """
+    years = list(years)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = {
+            year: [executor.submit(get_id_page, client.api_key, year, page,
+                                   client=client)
+                   for page in range(1, ID_PAGES_PER_YEAR + 1)]
+            for year in years
+        }
+        ids = {}
+        for year, futures in pages.items():
+            results = [future.result() for future in futures]
+            # dict.fromkeys keeps the popularity order while dropping duplicates
+            ids[year] = None if None in results else list(dict.fromkeys(
+                movie_id for page_ids in results for movie_id in page_ids))
+        return ids
+
+
+def fetch_details(client, movie_ids, max_workers=8):
+    """
+    Concurrently pull details for every film in {movie_ids}.
+
+    parameters:
+    client (TMDBClient): Client to send the requests with
+    movie_ids (iterable of str): TMDB ids of the films of interest
+    max_workers (int): Maximum number of requests in flight
+
+    returns:
+    generator of (str, dict): (movie id, film details) pairs in completion
+    order. Films that could not be fetched are skipped.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_data, client.api_key, movie_id,
+                                   client=client): movie_id
+                   for movie_id in movie_ids}
+        for future in as_completed(futures):
+            movie_id = futures[future]
+            details = future.result()
+            if details is None:
+                print(f"Could not fetch movie {movie_id}, skipping.")
+                continue
+            yield movie_id, details
+
+
+def get_changed_ids(client, start_date, end_date):
+    """
+    Function to get the ids of all films whose TMDB data changed between
+    {start_date} and {end_date}. TMDB only serves 14 days of changes per
+    call, so longer ranges are split into 14 day windows.
+
+    parameters:
+    client (TMDBClient): Client to send the requests with
+    start_date (datetime.date): First day of the range
+    end_date (datetime.date): Last day of the range
+
+    returns:
+    set of str: Ids of films that changed, or None if any page could not be
+    fetched, as a partial set would silently miss changes
+    """
+    changed = set()
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + datetime.timedelta(days=13), end_date)
+        page, total_pages = 1, 1
+        while page <= total_pages:
+            dict = client.get('/movie/changes',
+                              {'start_date': window_start.isoformat(),
+                               'end_date': window_end.isoformat(),
+                               'page': page})
+            if dict is None:
+                return None
+            changed.update(str(film['id']) for film in dict['results'])
+            total_pages = dict.get('total_pages', 1)
+            page += 1
+        window_start = window_end + datetime.timedelta(days=1)
+
+    return changed
+
+
+class CSVBatchWriter:
+    """
+    Writes a whole csv file through one open handle. Rows are buffered and
+    written {buffer_size} at a time to a temp file next to {filename},
+    which replaces {filename} only once every row was written. A crashed run
+    never leaves a half-written file behind.
+
+    Use as a context manager:
+
+    with CSVBatchWriter(filename, header) as writer:
+        writer.write(dict)
+
+    parameters:
+    filename (str): Name of the csv file
+    header (list of str): Optional first row
+    buffer_size (int): Number of rows to hold before writing them out
+    """
 
-    query = 'https://api.themoviedb.org/3/movie/' + Movie_ID + \
-        '?api_key=' + API_key + '&append_to_response=keywords,' + \
-            'watch/providers,credits&language=en-US'
-    for i in range(max_retries):
-        response = requests.get(query)
-        if response.status_code == 429:
-            # If the response was a 429, wait and then try again
-            print(
-                f"Request limit reached. Waiting and retrying ({i + 1}/{max_retries})")
-            time.sleep(2 ** i)  # Exponential backoff
+    def __init__(self, filename, header=None, buffer_size=500):
+        self.filename = filename
+        self.header = header
+        self.buffer_size = buffer_size
+        self.tmp_filename = f'{filename}.tmp'
+        self._rows = []
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        self._file = open(self.tmp_filename, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        if self.header is not None:
+            self._rows.append(self.header)
+        return self
+
+    def write(self, dict):
+        """
+        Adds the row of a film from its TMDB details.
+        """
+        self.write_row(record_to_row(movie_record(dict)))
+
+    def write_row(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self._writer.writerows(self._rows)
+        self._rows = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._file.close()
+
+        if exc_type is None:
+            os.replace(self.tmp_filename, self.filename)
         else:
-            dict = response.json()
-            return dict
+            os.remove(self.tmp_filename)
+        return False
 
 
 def write_file(filename, dict):
@@ -76,6 +526,8 @@ def write_file(filename, dict):
     movie belongs to a collection. The row contains the name of the
     movie in the first column and the name of the collection in the
     second column. Adds nothing if the film is not part of the collection.
+    Opens and closes the file on every call; use CSVBatchWriter to write
+    many rows.
 
     parameters:
     filename (str): Name of file you desire for the csv
@@ -84,9 +536,21 @@ def write_file(filename, dict):
     returns:
     None
     """
-    csvFile = open(filename, 'a')
-    csvwriter = csv.writer(csvFile)
-    # unpack the result to access the "collection name" element
+    with open(filename, 'a') as csvFile:
+        csv.writer(csvFile).writerow(record_to_row(movie_record(dict)))
+
+
+def movie_record(dict):
+    """
+    Parses the TMDB details of a film into a typed record. List fields stay
+    lists, so names containing commas survive intact.
+
+    parameters:
+    dict (dict): Python dictionary with JSON formatted details of film
+
+    returns:
+    dict: Record keyed by the catalog column names
+    """
     title = dict['title']
     runtime = dict['runtime']
     language_code = dict['original_language']
@@ -98,6 +562,7 @@ def write_file(filename, dict):
 
     # Parsing release date
     release_year = release_date.split('-')[0]
+    release_year = int(release_year) if release_year else None
 
     # Converting language
     try:
@@ -106,72 +571,34 @@ def write_file(filename, dict):
         language = 'Unknown'
 
     # Parsing genres
-    genre_str = ""
-    for genre in all_genres:
-        genre_str += genre['name'] + ", "
-    genre_str = genre_str[:-2]
+    genres = [genre['name'] for genre in all_genres]
 
     # Parsing keywords (remove non-English words)
-    all_keywords = dict['keywords']['keywords']
-    keyword_str = ""
-    for keyword in all_keywords:
-        if is_english(keyword['name']):
-            keyword_str += keyword['name'] + ", "
-    if keyword_str == "":
-        keyword_str = "None"
-    else:
-        keyword_str = keyword_str[:-2]
+    keywords = [keyword['name'] for keyword in dict['keywords']['keywords']
+                if is_english(keyword['name'])]
 
     # Parsing watch providers
     watch_providers = dict['watch/providers']['results']
-    stream_str, buy_str, rent_str = "", "", ""
+    providers = {'flatrate': [], 'buy': [], 'rent': []}
     if 'US' in watch_providers:
         watch_providers = watch_providers['US']
-        provider_strings = ['flatrate', 'buy', 'rent']
-        for string in provider_strings:
-            if string not in watch_providers:
-                continue
-
-            _str = ""
-
-            for element in watch_providers[string]:
-                _str += element['provider_name'] + ", "
-            _str = _str[:-2] + " "
-
-            if string == 'flatrate':
-                stream_str += _str
-            elif string == 'buy':
-                buy_str += _str
-            else:
-                rent_str += _str
+        for string in providers:
+            for element in watch_providers.get(string, []):
+                providers[string].append(element['provider_name'])
 
     credits = dict['credits']
-    actor_list, director_list = [], []
 
     # Parsing cast
-    cast = credits['cast']
     NUM_ACTORS = 5
-    for member in cast[:NUM_ACTORS]:
-        actor_list.append(member["name"])
+    actors = [member["name"] for member in credits['cast'][:NUM_ACTORS]]
 
     # Parsing crew
-    crew = credits['crew']
-    for member in crew:
-        if member['job'] == 'Director':
-            director_list.append(member["name"])
-
-    actor_str = ', '.join(list(set(actor_list)))
-    director_str = ', '.join(list(set(director_list)))
-
-    # Parsing production companies
-    prod_str = ""
-    for company in prod_companies:
-        prod_str += company['name'] + ", "
-    prod_str = prod_str[:-2]
+    directors = [member["name"] for member in credits['crew']
+                 if member['job'] == 'Director']
 
     # Checking for null in ratings
-    if rating == 'null':
-        rating = 0
+    if rating is None or rating == 'null':
+        rating = 0.0
     else:
         rating = round(float(rating), 1)
 
@@ -191,14 +618,55 @@ def write_file(filename, dict):
     #     # Otherwise, append a blank string
     #     wiki_summary = ""
 
-    result = [title, runtime, language, overview,
-              release_year, genre_str, keyword_str,
-              actor_str, director_str, stream_str,
-              buy_str, rent_str, prod_str, rating]
+    return {
+        'TMDB ID': str(dict['id']),
+        'Title': title,
+        'Runtime (minutes)': runtime,
+        'Language': language,
+        'Overview': overview,
+        'Release Year': release_year,
+        'Genre': genres,
+        'Keywords': keywords,
+        'Actors': unique(actors),
+        'Directors': unique(directors),
+        'Stream': providers['flatrate'],
+        'Buy': providers['buy'],
+        'Rent': providers['rent'],
+        'Production Companies': [company['name'] for company in prod_companies],
+        'Rating': rating,
+    }
+
+
+def unique(items):
+    """
+    Drops duplicates from {items} while keeping their order.
+    """
+    return list(dict.fromkeys(items))
+
 
-    # write data
-    csvwriter.writerow(result)
-    csvFile.close()
+def record_to_row(record):
+    """
+    Formats a movie record as a row of the yearly csv files.
+
+    parameters:
+    record (dict): Record from movie_record
+
+    returns:
+    list: Row with the columns of the yearly csv files
+    """
+    def providers(names):
+        return ', '.join(names) + ' ' if names else ''
+
+    release_year = record['Release Year']
+    return [record['Title'], record['Runtime (minutes)'], record['Language'],
+            record['Overview'],
+            '' if release_year is None else str(release_year),
+            ', '.join(record['Genre']),
+            ', '.join(record['Keywords']) or 'None',
+            ', '.join(record['Actors']), ', '.join(record['Directors']),
+            providers(record['Stream']), providers(record['Buy']),
+            providers(record['Rent']),
+            ', '.join(record['Production Companies']), record['Rating']]
 
 
 def is_english(s):
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+CATALOG_VERSION_PATH = './data/catalog_version.json'
+ID_FIELD = 'TMDB ID'
+# Metadata field each vector's doc_hash is stored under
+HASH_FIELD = 'content_hash'
+DELETE_BATCH_SIZE = 1000
+FETCH_BATCH_SIZE = 200
+
+
+def doc_id(doc):
+    """
+    Deterministic vector id of a film: its TMDB id.
+    """
+    return str(doc.metadata[ID_FIELD])
+
+
+def doc_hash(doc):
+    """
+    Hash of everything that ends up in the vector store for {doc}, so a
+    change to either the embedded text or the metadata triggers an upsert.
+    """
+    payload = json.dumps([doc.page_content, doc.metadata], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def list_indexed_ids(pc_index, namespace):
+    """
+    All vector ids currently stored in {namespace}.
+    """
+    indexed = set()
+    for ids in pc_index.list(namespace=namespace):
+        indexed.update(ids)
+    return indexed
+
+
+def fetch_indexed_hashes(pc_index, namespace):
+    """
+    Reads back the doc_hash stored with every vector in {namespace}, so the
+    sync is planned against the index itself rather than local state.
+
+    returns:
+    dict: Vector id to content hash, None for vectors stored without one
+    """
+    ids = sorted(list_indexed_ids(pc_index, namespace))
+    hashes = {}
+    for i in range(0, len(ids), FETCH_BATCH_SIZE):
+        response = pc_index.fetch(ids=ids[i:i + FETCH_BATCH_SIZE], namespace=namespace)
+        for id, vector in response.vectors.items():
+            hashes[id] = (vector.metadata or {}).get(HASH_FIELD)
+    return hashes
+
+
+def plan_sync(docs, indexed_hashes):
+    """
+    Diffs the desired corpus against what is already indexed.
+
+    parameters:
+    docs (list of Document): Every film that should be searchable
+    indexed_hashes (dict): Content hash of each vector in the index
+
+    returns:
+    (list of Document, list of str): Docs to upsert because they are new or
+    changed, and ids to delete because their film left the catalog
+    """
+    desired = {}
+    for doc in docs:
+        desired[doc_id(doc)] = doc
+
+    to_upsert = [doc for id, doc in desired.items()
+                 if indexed_hashes.get(id) != doc_hash(doc)]
+    to_delete = sorted(indexed_hashes.keys() - desired.keys())
+    return to_upsert, to_delete
+
+
+def delete_ids(pc_index, ids, namespace):
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        pc_index.delete(ids=ids[i:i + DELETE_BATCH_SIZE], namespace=namespace)
+
+
+def catalog_version(synced_hashes):
+    """
+    Version of the indexed catalog: a hash over every vector id and content
+    hash, so it only changes when the index content does.
+    """
+    payload = json.dumps(sorted(synced_hashes.items()))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def write_catalog_version(version, path=CATALOG_VERSION_PATH):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(tmp_path, path)
+
+
+def read_catalog_version(path=CATALOG_VERSION_PATH):
+    """
+    Version written by the last Pinecone flow run, or None if there is none.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)['version']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None